@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Rolling-window analytics of the JHU series.
+
+For every country and the world, and every metric (confirmed, deaths,
+recovered), the statistics below are computed with whole-array operations on
+the dense (country x date) rollups of timeseries.TimeSeries. New dates only
+compute the new columns (from the last two weeks before them), so the values
+are always precomputed and requests just index them.
+
+    daily               new cases per date
+    mean7               7-day average of the new cases
+    growth              week over week growth of the new cases (0.1 = +10%)
+    doubling            days for the cumulative count to double at the past week's pace
+    per_million         cumulative count per million inhabitants
+    mean7_per_million   7-day average of the new cases per million inhabitants
+
+Values are NaN where the window is incomplete or the ratio is undefined.
+Country values are stored as float32, the world as float64.
+"""
+
+import copy
+
+import numpy as np
+
+WINDOW = 7
+# columns a new date depends on, two windows (growth) and a day (daily)
+PAD = 2 * WINDOW + 1
+
+STATS = ('daily', 'mean7', 'growth', 'doubling', 'per_million', 'mean7_per_million')
+
+# JHU country names that OWID spells differently
+OWID_NAMES = {
+    'US': 'United States',
+    'Korea, South': 'South Korea',
+    'Taiwan*': 'Taiwan',
+    'Burma': 'Myanmar',
+    'Congo (Kinshasa)': 'Democratic Republic of Congo',
+    'Congo (Brazzaville)': 'Congo',
+    'Cabo Verde': 'Cape Verde',
+    'West Bank and Gaza': 'Palestine',
+    'Holy See': 'Vatican',
+    'Czechia': 'Czech Republic',
+    'Timor-Leste': 'Timor',
+}
+
+
+def population(data):
+    """OWID population of every country of data.series, NaN where unknown."""
+    demographic = data.demographic_df2
+    if 'population' not in demographic:
+        return np.full(len(data.series.countries), np.nan)
+    known = dict(zip(demographic['location'].astype(object), demographic['population']))
+    return np.array([known.get(OWID_NAMES.get(country, country), np.nan)
+                     for country in data.series.countries], dtype=np.float64)
+
+
+def rolling(cumulative, population):
+    """Every statistic of the rows of a (rows x dates) cumulative array."""
+    cumulative = cumulative.astype(np.float64)
+    stats = {}
+    stats['daily'] = np.diff(cumulative, axis=1, prepend=np.nan)
+
+    weekly = np.full(cumulative.shape, np.nan)
+    weekly[:, WINDOW:] = cumulative[:, WINDOW:] - cumulative[:, :-WINDOW]
+    previous = np.full(cumulative.shape, np.nan)
+    previous[:, WINDOW:] = weekly[:, :-WINDOW]
+    stats['mean7'] = weekly / WINDOW
+
+    doubling = np.full(cumulative.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = weekly / previous - 1
+        doubling[:, WINDOW:] = WINDOW * np.log(2) / np.log(cumulative[:, WINDOW:] / cumulative[:, :-WINDOW])
+        per_million = 1e6 / population[:, None]
+    growth[~np.isfinite(growth)] = np.nan
+    # no (or an unknown) population has no per-capita counts
+    per_million[~np.isfinite(per_million)] = np.nan
+    # no growth (or shrinking counts) never doubles
+    doubling[~np.isfinite(doubling) | (doubling <= 0)] = np.nan
+    stats['growth'] = growth
+    stats['doubling'] = doubling
+    stats['per_million'] = cumulative * per_million
+    stats['mean7_per_million'] = stats['mean7'] * per_million
+    return stats
+
+
+class Analytics(object):
+    """
+    country[metric][stat]  (country x date) array, rows in series.countries order
+    world[metric][stat]    per date array
+    """
+
+    def __init__(self, series, population):
+        self.population = population
+        self.world_population = np.nansum(population)
+        self.country = {}
+        self.world = {}
+        for metric in series.country:
+            self.country[metric], self.world[metric] = self._compute(series, metric, 0)
+
+    def _compute(self, series, metric, start):
+        # stats of the columns from start on, computed from the PAD columns before them
+        offset = max(start - PAD, 0)
+        country = rolling(series.country[metric][:, offset:], self.population)
+        world = rolling(series.world[metric][None, offset:], np.array([self.world_population]))
+        return ({stat: values[:, start - offset:].astype(np.float32) for stat, values in country.items()},
+                {stat: values[0, start - offset:] for stat, values in world.items()})
+
+    def append(self, series):
+        """Analytics of series, which extends the one these were computed from."""
+        extended = copy.copy(self)
+        extended.country = {}
+        extended.world = {}
+        for metric in series.country:
+            known = self.world[metric]['daily'].shape[0]
+            country, world = self._compute(series, metric, known)
+            extended.country[metric] = {stat: np.hstack([self.country[metric][stat], values])
+                                        for stat, values in country.items()}
+            extended.world[metric] = {stat: np.concatenate([self.world[metric][stat], values])
+                                      for stat, values in world.items()}
+        return extended
+
+    def with_population(self, series, population):
+        """Analytics with the per-capita statistics recomputed for a new population."""
+        return Analytics(series, population)
+
+    def latest(self, metric, stat):
+        """Latest world value of a statistic."""
+        return self.world[metric][stat][-1].item()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Read-only data API (/api/v1/...), served from the current data generation.
+
+    /api/v1/world        the world's counts and statistics per date
+    /api/v1/countries    every country's latest counts and statistics
+    /api/v1/timeseries   counts and statistics per country and date
+
+Every table is cut straight from the dense series (timeseries.TimeSeries) and
+the precomputed analytics, nothing is regrouped per request. Query arguments:
+
+    country     a country of /api/v1/timeseries, repeated for several (all by default)
+    from, to    ISO dates of the first and last date of the world and the timeseries
+    fields      comma separated columns to return, only those are computed
+    offset      first row (default 0)
+    limit       rows per page (default COVID19_API_PAGE_SIZE, 10000)
+    format      json (an array of records), ndjson (a record per line) or
+                arrow (Arrow IPC stream, needs pyarrow), the Accept header otherwise
+
+Responses are streamed in chunks of ROWS_PER_CHUNK rows, gzip compressed when
+the client accepts it. X-Total-Count carries the number of rows and a Link
+header the next page. The ETag names the source files of the data and the
+query, so polling clients get a 304 from any worker until the data changes.
+"""
+
+import hashlib
+import io
+import os
+import zlib
+from collections import OrderedDict
+
+import flask
+import numpy as np
+from werkzeug.urls import url_encode
+
+import dataset
+import serving
+import timerange
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+PAGE_SIZE = int(os.environ.get('COVID19_API_PAGE_SIZE', 10000))
+MAX_PAGE_SIZE = 100000
+ROWS_PER_CHUNK = 1000
+# decimals of the float columns
+DECIMALS = 3
+
+MIMETYPES = OrderedDict([
+    ('json', 'application/json'),
+    ('ndjson', 'application/x-ndjson'),
+    ('arrow', 'application/vnd.apache.arrow.stream'),
+])
+
+
+class BadRequest(ValueError):
+    """A query argument the API cannot answer, a 400."""
+
+
+def _length(series):
+    # the files can briefly differ by a date while a refresh appends to them
+    return min(len(series.dates[name]) for name in dataset.JHU_SOURCES)
+
+
+def _window(series):
+    # the dates from ?from= to ?to=
+    days = series.days['confirmed'][:_length(series)]
+    try:
+        start, end = (timerange.day(flask.request.args[name]) if flask.request.args.get(name) else None
+                      for name in ('from', 'to'))
+    except ValueError:
+        raise BadRequest("from and to are ISO dates")
+    return timerange.window(days, start, end)
+
+
+def _columns(data, codes, cut):
+    """
+    Column builders of the (country x date) rows of the countries at codes (the
+    world when None) and the dates at cut. A builder computes a page (a slice
+    of the rows) of its column, only when the column is asked for.
+    """
+    series = data.series
+    stats = data.analytics.world if codes is None else data.analytics.country
+    dates = np.asarray(timerange.iso(series.days['confirmed'][cut]), dtype=object)
+    rows = 1 if codes is None else len(codes)
+    # rows of a country, not zero for the divisions when the window is empty
+    per_country = max(len(dates), 1)
+
+    def block(page):
+        # the countries of the page, and the page within their rows
+        first, last = page.start // per_country, -(-page.stop // per_country)
+        return slice(first, last), slice(page.start - first * per_country, page.stop - first * per_country)
+
+    def values(array, page):
+        # a page of the rows of a (country x date) array, or of the dates of a world array
+        if codes is None:
+            return array[cut][page]
+        countries, within = block(page)
+        return array[codes[countries]][:, cut].ravel()[within]
+
+    def country(page):
+        countries, within = block(page)
+        return np.repeat(series.countries[codes[countries]].to_numpy(dtype=object), len(dates))[within]
+
+    def date(page):
+        if codes is None:
+            return dates[page]
+        countries, within = block(page)
+        return np.tile(dates, len(codes[countries]))[within]
+
+    columns = OrderedDict()
+    if codes is not None:
+        columns['country'] = country
+    columns['date'] = date
+    for name in dataset.JHU_SOURCES:
+        columns[name] = lambda page, name=name: values(
+            (series.world if codes is None else series.country)[name], page)
+    columns['active'] = lambda page: (
+        columns['confirmed'](page) - columns['deaths'](page) - columns['recovered'](page))
+    for name in dataset.JHU_SOURCES:
+        for stat in stats[name]:
+            columns[name + '_' + stat] = lambda page, name=name, stat=stat: values(stats[name][stat], page)
+
+    def rate(name, page):
+        # percent of the confirmed cases, NaN before the first one
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return columns[name](page) / columns['confirmed'](page) * 100
+    columns['recovery_rate'] = lambda page: rate('recovered', page)
+    columns['mortality_rate'] = lambda page: rate('deaths', page)
+    return rows * len(dates), columns
+
+
+def world(data):
+    """Rows of the world per date."""
+    return _columns(data, None, _window(data.series))
+
+
+def countries(data):
+    """A row per country, its latest values."""
+    series = data.series
+    length = _length(series)
+    present = np.flatnonzero(series.regions)
+    rows, columns = _columns(data, present, slice(length - 1, length))
+    return rows, OrderedDict([
+        ('country', columns.pop('country')),
+        ('lat', lambda page: series.positions[present[page], 0]),
+        ('long', lambda page: series.positions[present[page], 1]),
+        ('population', lambda page: data.analytics.population[present[page]]),
+    ] + list(columns.items()))
+
+
+def time_series(data):
+    """Rows per country and date, of the ?country= countries."""
+    series = data.series
+    names = flask.request.args.getlist('country')
+    if names:
+        codes = series.countries.get_indexer(names)
+        if (codes < 0).any() or not series.regions[codes].all():
+            raise BadRequest("unknown country")
+    else:
+        codes = np.flatnonzero(series.regions)
+    return _columns(data, codes, _window(series))
+
+
+# ---------------------------------------------------------------------------------------------
+# Responses
+
+def _format():
+    requested = flask.request.args.get('format')
+    if requested is None:
+        requested = next((name for name, mimetype in MIMETYPES.items()
+                          if mimetype == flask.request.accept_mimetypes.best_match(
+                              list(MIMETYPES.values()), MIMETYPES['json'])))
+    if requested not in MIMETYPES:
+        raise BadRequest("format is one of " + ', '.join(MIMETYPES))
+    if requested == 'arrow' and pyarrow is None:
+        raise BadRequest("arrow needs pyarrow")
+    return requested
+
+
+def _page(length):
+    try:
+        offset = int(flask.request.args.get('offset', 0))
+        limit = int(flask.request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("offset and limit are integers")
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise BadRequest("offset is positive, limit up to %d" % MAX_PAGE_SIZE)
+    return slice(offset, min(offset + limit, length))
+
+
+def _plain(column):
+    # JSON values of a column, NaN and infinities (not JSON) as null
+    if column.dtype.kind != 'f':
+        return column.tolist()
+    column = np.round(column.astype(np.float64), DECIMALS)
+    return np.where(np.isfinite(column), column, None).tolist()
+
+
+def _records(names, columns, records_format):
+    for start in range(0, len(columns[0]) if columns else 0, ROWS_PER_CHUNK):
+        chunk = zip(*[_plain(column[start:start + ROWS_PER_CHUNK]) for column in columns])
+        records = [serving.encode(OrderedDict(zip(names, row))) for row in chunk]
+        if records_format == 'ndjson':
+            yield b''.join(record + b'\n' for record in records)
+        else:
+            yield (b'[' if start == 0 else b',') + b','.join(records)
+    if records_format == 'json':
+        yield b']' if columns and len(columns[0]) else b'[]'
+
+
+def _arrow(names, columns):
+    # an Arrow IPC stream, a record batch per chunk
+    sink = io.BytesIO()
+    writer = None
+    # an empty page is a stream with an empty batch
+    for start in range(0, max(len(columns[0]), 1), ROWS_PER_CHUNK):
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column[start:start + ROWS_PER_CHUNK], from_pandas=True) for column in columns],
+            names)
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(serving.GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def response(data, table):
+    """Streamed response of table(data), a page of its rows with the requested fields."""
+    args = flask.request.args
+    try:
+        length, builders = table(data)
+        fields = args['fields'].split(',') if args.get('fields') else list(builders)
+        unknown = [field for field in fields if field not in builders]
+        if unknown:
+            raise BadRequest("unknown fields: " + ', '.join(unknown))
+        response_format = _format()
+        page = _page(length)
+    except BadRequest as error:
+        return flask.jsonify(error=str(error)), 400
+
+    # a strong ETag names one exact representation
+    encoding = 'gzip' if 'gzip' in flask.request.accept_encodings else None
+    # the sources of the generation, its version is only the same across workers sharing the arena
+    sources = ' '.join('%s:%s' % item for item in sorted(data.digests.items()))
+    query = hashlib.sha1(('%s %s %s' % (sources, flask.request.full_path, response_format)).encode('utf-8'))
+    etag = query.hexdigest()[:24] + ('-' + encoding if encoding else '')
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    columns = [builders[field](page) for field in fields]
+    if response_format == 'arrow':
+        chunks = _arrow(fields, columns)
+    else:
+        chunks = _records(fields, columns, response_format)
+    response = flask.Response(_gzip(chunks) if encoding else chunks, mimetype=MIMETYPES[response_format])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['Cache-Control'] = serving.CACHE_CONTROL
+    response.headers['X-Total-Count'] = str(length)
+    response.headers['X-Data-Version'] = str(data.version)
+    if page.stop < length:
+        query = args.copy()
+        query['offset'] = page.stop
+        response.headers['Link'] = '<%s?%s>; rel="next"' % (flask.request.base_url, url_encode(query))
+    response.set_etag(etag)
+    return response
@@ -9,36 +9,35 @@ Dataset:
 
 # ---------------------------------------------------------------------------------------------
 # imports
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-
 # -*- coding: utf-8 -*-
-import dash
+import functools
+
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash import callback_context
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import abort, jsonify, request, send_file
+
+import context
+import profiling
+import serving
+
+# The data modules pull in pandas, numpy and plotly.express. They are imported by the
+# loading thread (see context.py) or on first use, not with the app
+api = context.LazyModule('api')
+countries = context.LazyModule('countries')
+dataset = context.LazyModule('dataset')
+figures = context.LazyModule('figures')
+images = context.LazyModule('images')
+np = context.LazyModule('numpy')
+timerange = context.LazyModule('timerange')
 # ---------------------------------------------------------------------------------------------
 
 external_stylesheets = ['https://codepen.io/anon/pen/mardKv.css',
                         'https://codepen.io/amyoshino/pen/jzXypZ.css']
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-server = app.server
-
-
-# Overwrite your CSS setting by including style locally
-colors = {
-    'background': '#2D2D2D',
-    'text': '#E1E2E5',
-    'figure_text': '#ffffff',
-    'confirmed_text': '#3CA4FF',
-    'deaths_text': '#f44336',
-    'recovered_text': '#5A9E6F',
-    'highest_case_bg': '#393939',
-    'active_text': '#ffa500',
-}
 
 # Creating custom style for local use
 divBorderStyle = {
@@ -57,683 +56,800 @@ boxBorderStyle = {
 
 
 # ---------------------------------------------------------------------------------------------
-# Collecting and cleaning data (importing csv into pandas)
-# importing datasets
-death_df = pd.read_csv(
-    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv")
-confirmed_df = pd.read_csv(
-    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv")
-recovered_df = pd.read_csv(
-    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv")
-url = 'https://raw.githubusercontent.com/imdevskp/covid_19_jhu_data_web_scrap_and_cleaning/master/covid_19_clean_complete.csv'
-full_table = pd.read_csv(url,
-                         parse_dates=['Date'])
-demographic_df = pd.read_csv(
-    'https://covid.ourworldindata.org/data/owid-covid-data.csv')
-
-not_na = demographic_df["continent"].notna()
-demographic_df2 = demographic_df[not_na]
-demographic_df3 = demographic_df.dropna(
-    subset=['total_deaths_per_million', 'continent'])
-demographic_df3['gdp_per_capita'].fillna(0)
-
-# cases
-cases = ['Confirmed', 'Deaths', 'Recovered', 'Active']
-
-# Active Case = confirmed - deaths - recovered
-full_table['Active'] = full_table['Confirmed'] - \
-    full_table['Deaths'] - full_table['Recovered']
-
-# replacing Mainland china with just China
-full_table['Country/Region'] = full_table['Country/Region'].replace(
-    'Mainland China', 'China')
-
-# filling missing values
-full_table[['Province/State']] = full_table[['Province/State']].fillna('')
-full_table[cases] = full_table[cases].fillna(0)
-
-# latest
-full_latest = full_table[full_table['Date']
-                         == max(full_table['Date'])].reset_index()
-
-# latest condensed
-full_latest_grouped = full_latest.groupby(
-    'Country/Region')['Confirmed', 'Deaths', 'Recovered', 'Active'].sum().reset_index()
-
-temp = full_table.groupby(['Country/Region', 'Province/State']
-                          )['Confirmed', 'Deaths', 'Recovered', 'Active'].max()
-
-# hide_input
-temp = full_table.groupby(
-    'Date')['Confirmed', 'Deaths', 'Recovered', 'Active'].sum().reset_index()
-temp = temp[temp['Date'] == max(temp['Date'])].reset_index(drop=True)
-
-temp = full_table.groupby(
-    'Date')['Recovered', 'Deaths', 'Active'].sum().reset_index()
-temp = temp.melt(id_vars="Date", value_vars=['Recovered', 'Deaths', 'Active'],
-                 var_name='Case', value_name='Count')
-# print(temp)
-
-# create extra columns for radio buttons
-temp["Date2"] = temp["Date"]
-
-print("Here 1")
-
-# Rename to consistent values
-confirmed_df['Country/Region'].replace('Mainland China', 'China', inplace=True)
-death_df['Country/Region'].replace('Mainland China', 'China', inplace=True)
-recovered_df['Country/Region'].replace('Mainland China', 'China', inplace=True)
-
-print("Here 2")
-
-# rename
-confirmed_df = confirmed_df.rename(columns={'Country/Region': 'country'})
-death_df = death_df.rename(columns={'Country/Region': 'country'})
-recovered_df = recovered_df.rename(columns={'Country/Region': 'country'})
-
-print("Here 3")
-
-# Handle empty data
-confirmed_df[['Province/State']] = confirmed_df[['Province/State']].fillna('')
-confirmed_df.fillna(0, inplace=True)
-death_df[['Province/State']] = death_df[['Province/State']].fillna('')
-death_df.fillna(0, inplace=True)
-recovered_df[['Province/State']] = recovered_df[['Province/State']].fillna('')
-recovered_df.fillna(0, inplace=True)
-
-print("Here 4")
-
-# Aggregating all the data to see a snapshot of the total number of cases
-# the columns up to four are non-integer columns
-total_confirmed = confirmed_df.iloc[:, 4:].sum().max()
-total_deaths = death_df.iloc[:, 4:].sum().max()
-total_recovered = recovered_df.iloc[:, 4:].sum().max()
-total_active = total_confirmed - (total_deaths + total_recovered)
-# print(total_confirmed, total_deaths, total_recovered)
-
-print("Here 5")
-
-# the total number of active cases is: Active = confimred - deaths - recovered
-world_df = pd.DataFrame({
-    'confirmed': [total_confirmed],
-    'deaths': [total_deaths],
-    'recovered': [total_recovered],
-    'active': [total_confirmed - total_deaths - total_recovered]
-})
-# print(world_df)
-
-print("Here 6")
-
-# unpivot the dataframe from wide to long format
-word_long_df = world_df.melt(
-    value_vars=['active', 'deaths', 'recovered'], var_name="status", value_name="count")
-word_long_df['upper'] = 'confirmed'
-# print(word_long_df)
-
-print("Here 7")
-
-# time series
-worldwide_confirmed = confirmed_df.iloc[:, 4:].sum(axis=0)
-worldwide_deaths = death_df.iloc[:, 4:].sum().max(axis=0)
-worldwide_recovered = recovered_df.iloc[:, 4:].sum(axis=0)
-worldwide_active = worldwide_confirmed - worldwide_deaths - worldwide_recovered
-
-print("Here 8")
-
-# calculate recovery and mortality rates as a fraction of confirmed
-world_rate_df = pd.DataFrame({
-    'confirmed': worldwide_confirmed,
-    'deaths': worldwide_deaths,
-    'recovered': worldwide_recovered,
-    'active': worldwide_active
-}, index=worldwide_confirmed.index)
-
-print("Here 9")
-
-world_rate_df['recovery rate'] = world_rate_df['recovered'] / \
-    world_rate_df['confirmed'] * 100
-world_rate_df['mortality rate'] = world_rate_df['deaths'] / \
-    world_rate_df['confirmed'] * 100
-world_rate_df['date'] = world_rate_df.index
-# print(world_rate_df)
-print("Here 10")
-
-# unpivot the dataframe from wide to long format
-word_rate_long_df = world_rate_df.melt(id_vars='date',
-                                       value_vars=['recovery rate', 'mortality rate'], var_name="status", value_name="ratio")
-# print(word_rate_long_df)
-
-print("Here 11")
-
-# group by rows that contain the country/region values and then sum all the values
-covid_confirmed_agg = confirmed_df.groupby(
-    'country').sum().reset_index()
-
-covid_confirmed_agg.loc[:, ['Lat', 'Long']
-                        ] = confirmed_df.groupby('country').mean().reset_index().loc[:, ['Lat', 'Long']]
+# Collecting and cleaning data (served from the local snapshot store, see datastore.py).
+# Every frame and figure lives on a dataset generation, refresh.py publishes new ones and
+# arena.py shares the frames with the other gunicorn workers. context.py loads the first
+# generation in the background, the routes and callbacks only run once it is there.
+
+
+# seconds a client is asked to wait while the data loads
+RETRY_AFTER = 5
+
+
+def unavailable():
+    # 503 while the first data generation loads, the server answers before it exists
+    response = jsonify(context.status())
+    response.status_code = 503
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+def needs_data(view):
+    """Route answering 503 (see unavailable) until the data is loaded."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not context.ready():
+            return unavailable()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def register_routes(app):
+    server = app.server
+
+    @server.route('/healthz')
+    def healthz():
+        # the process is up, whether or not the data is loaded
+        return jsonify(context.status())
+
+    @server.route('/readyz')
+    def readyz():
+        # 503 until the first data generation is loaded
+        if not context.ready():
+            return unavailable()
+        return jsonify(context.status())
+
+    if profiling.DEBUG_ENDPOINT:
+        @server.route('/debug/startup')
+        def debug_startup():
+            # startup phases, memory and callback latencies of the worker serving the request
+            return jsonify(profiling.report())
+
+        @server.route('/debug/validation')
+        @needs_data
+        def debug_validation():
+            # what validation.py found and corrected in the JHU series of the current generation
+            return jsonify(dataset.current().series.audit_report())
+
+    @server.route('/api/country/<path:country>')
+    @needs_data
+    def country_api(country):
+        # one country's series, daily changes, rates and provinces from the country index
+        data = dataset.current()
+        if country not in countries.index(data):
+            abort(404)
+        return app.payloads.get('country:' + country, data.version, lambda: serving.encode(
+            countries.index(data).lookup(country))).response(serving.CACHE_CONTROL)
+
+    @server.route('/api/range')
+    @needs_data
+    def range_api():
+        # every country's series of a metric over ?from=&to= (ISO dates), downsampled to
+        # ?points= per country (see timerange.py)
+        data = dataset.current()
+        metric = request.args.get('metric', 'confirmed')
+        if metric not in dataset.JHU_SOURCES:
+            abort(400)
+        try:
+            start, end = (timerange.day(request.args[name]) if request.args.get(name) else None
+                          for name in ('from', 'to'))
+            points = min(int(request.args.get('points', timerange.MAX_POINTS)), len(data.series.days[metric]))
+        except ValueError:
+            abort(400)
+        series = data.series
+        present = np.flatnonzero(series.regions)
+        dates, counts = timerange.downsample(series.days[metric], series.country[metric][present],
+                                             start, end, points)
+        world_dates, world_counts = timerange.downsample(series.days[metric], series.world[metric][None],
+                                                         start, end, points)
+        return serving.Payload(serving.encode({
+            'metric': metric,
+            'world': {'dates': world_dates[0], 'values': world_counts[0]},
+            'countries': [{'country': country, 'dates': x, 'values': y}
+                          for country, x, y in zip(series.countries[present], dates, counts)],
+        })).response(serving.CACHE_CONTROL)
+
+    # read-only data API, pages of the tables streamed as JSON, NDJSON or Arrow (see api.py)
+    @server.route('/api/v1/world')
+    @needs_data
+    def world_api():
+        return api.response(dataset.current(), api.world)
+
+    @server.route('/api/v1/countries')
+    @needs_data
+    def countries_api():
+        return api.response(dataset.current(), api.countries)
+
+    @server.route('/api/v1/timeseries')
+    @needs_data
+    def timeseries_api():
+        return api.response(dataset.current(), api.time_series)
+
+    @server.route('/images/<name>.<image_format>')
+    @needs_data
+    def image(name, image_format):
+        # the latest static image of a figure (see images.py), 404 until it is rendered
+        if name not in images.IMAGE_FIGURES or image_format not in images.FORMATS:
+            abort(404)
+        path = images.ready(dataset.current(), name, image_format)
+        if path is None:
+            abort(404)
+        response = send_file(path, mimetype=images.MIMETYPES[image_format], conditional=True)
+        response.headers['Cache-Control'] = serving.CACHE_CONTROL
+        return response
+
+
+# graph id -> figure shown as a static image first
+STATIC_GRAPHS = {
+    'map_graph': 'fig_map',
+    'line_graph': 'fig_line',
+    'tree_graph': 'fig_tree',
+}
 
-# covid_confirmed_agg = covid_confirmed_agg[covid_confirmed_agg.iloc[:, 3:].max(
-#     axis=1)]
 
-print("Here 12")
+def static_first(graph, image, children):
+    # The image (a path from images.ready) of the graph's figure until its button is
+    # clicked, children (the graph) stay hidden until then. n_clicks is 0 while the image
+    # shows, -1 when there is none
+    version = image and image.rsplit('.', 2)[1]
+    return html.Div([
+        html.Div([
+            # under the app's path prefix (requests_pathname_prefix)
+            html.Img(src=image and app.get_relative_path('/images/%s.svg?v=%s' % (STATIC_GRAPHS[graph], version)),
+                     style={'width': '100%'}),
+            html.Button('Interactive', id=graph + '_hydrate', n_clicks=0 if image else -1),
+        ], id=graph + '_static', style={} if image else {'display': 'none'}),
+        html.Div(children, id=graph + '_interactive', style={'display': 'none'} if image else {}),
+    ])
 
-# Since there are a lot of countries, for easy visualization let us only look at countries with high numbers
-MIN_CASES = 10000
-covid_confirmed_agg = covid_confirmed_agg[covid_confirmed_agg.iloc[:, 3:].max(
-    axis=1) > MIN_CASES]
-
-covid_confirmed_agg_long = pd.melt(covid_confirmed_agg,
-                                   id_vars=covid_confirmed_agg.iloc[:, :3],
-                                   var_name='date',
-                                   value_vars=covid_confirmed_agg.iloc[:, 3:],
-                                   value_name='date_confirmed_cases')
 
+def month_marks(days):
+    # slider marks on the first of every month, days are day numbers
+    return {day: label[:7] for day, label in zip(days.tolist(), timerange.iso(days)) if label.endswith('-01')}
 
-print("Here 13")
 
 # ---------------------------------------------------------------------------------------------
 
+def placeholder_layout():
+    # served while the first data generation loads, the page reloads itself once it is ready
+    return html.Div([
+        html.H1("COVID19 Web Application"),
+        html.P("Loading the latest data, this page refreshes when it is ready."),
+        dcc.Interval(id='placeholder_interval', interval=2000),
+        dcc.Location(id='placeholder_location', refresh=True),
+    ], style={'textAlign': 'center', 'color': '#FFFFFF', 'backgroundColor': '#1E1E1E'})
 
-# ---------------------------------------------------------------------------------------------
-# Visualizations
-print("Here 14")
-# World map
-fig_map = px.scatter_geo(covid_confirmed_agg_long,
-                         lat="Lat", lon="Long", color="country",
-                         hover_name="country", size="date_confirmed_cases",
-                         size_max=80,
-                         projection="natural earth",
-                         title="COVID-19 Worldwide Confirmed Cases Over Time")
-fig_map.update_layout(
-    margin={'t': 30, 'l': 0, 'r': 0, 'b': 0},
-    plot_bgcolor=colors['background'],
-    paper_bgcolor=colors['background'],
-    font_color=colors['text']
-)
-
-print("Here 15")
-# print(full_latest)
-# Tree map
-full_latest["world"] = "world"
-fig_tree = px.treemap(full_latest.sort_values(by='Confirmed', ascending=False).reset_index(drop=True), path=[
-    "world", "Country/Region", "Province/State"], title="Total Number of Cases",
-    values="Confirmed", color_discrete_sequence=px.colors.qualitative.Prism, template="seaborn")
-fig_tree.data[0].textinfo = 'label+text+value'
-fig_tree.update_layout(
-    margin={'t': 50, 'l': 0, 'r': 0, 'b': 0},
-    plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-
-# Area chart
-# fig_area = px.area(temp, x="Date", y="Count", color='Case',
-#                    title='Evolution of Cases Status', color_discrete_sequence=["green", "red", "blue"])
-# fig_area.update_layout(
-#     margin={'l': 0, 'r': 0, 'b': 0},
-#     plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-
-# Bar Chart
-# fig_bar = px.bar(temp, x="Date", y="Count", color='Case',
-#                  title='Cases over time', color_discrete_sequence=["green", "red", "blue"])
-# fig_bar.update_layout(
-#     plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-
-# print(covid_confirmed_agg_long)
-fig_line = px.line(covid_confirmed_agg_long, x="date", y="date_confirmed_cases", title="Evolution of Cases Over Time", color="country",
-                   line_group="country", hover_name="country")
-fig_line.update_layout(
-    margin={'l': 0, 'r': 0, 'b': 0},
-    plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-
-#
-fig_matrix = px.scatter_matrix(demographic_df2, dimensions=["gdp_per_capita", "hospital_beds_per_thousand", "handwashing_facilities", "life_expectancy"],
-                               labels={
-                                   "gdp_per_capita": 'GDPperCap',
-                                   "hospital_beds_per_thousand": 'BedsPer1000',
-                                   "handwashing_facilities": 'Handwashing',
-                                   "life_expectancy": "LifeExp"
-},
-    color="continent", hover_name="location", symbol="continent",
-    title="What are some factors of GDP and Life Expectancy that might contribute to the Coronavirus?")
-fig_matrix.update_traces(diagonal_visible=True)
-# fig_matrix.update_yaxes(tickangle=45)
-fig_matrix.update_layout(
-    paper_bgcolor=colors['background'], font_color=colors['text'])
-
-df = px.data.gapminder()
-fig_scatter = px.scatter(df, x="gdpPercap", y="lifeExp", animation_frame="year", animation_group="country",
-                         title="Overtime you will see that as GDP increases, life expectancy also increases.",
-                         size="pop", color="continent", hover_name="country", facet_col="continent",
-                         log_x=True, size_max=45, range_x=[100, 100000], range_y=[25, 90])
-fig_scatter.update_layout(
-    plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-
-fig_scatter2 = px.scatter(demographic_df3, x="gdp_per_capita", y="life_expectancy",
-                          title="Is there a relationship between GDP, Life Expectancy, and the Coronavirus?",
-                          size="total_deaths_per_million", color="continent",
-                          hover_name="location", log_x=True, size_max=60)
-fig_scatter2.update_layout(
-    plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
-# ---------------------------------------------------------------------------------------------
-
-
-print("Here 16")
 
 # App layout (contains all the html components: the graphs, drop down, etc)
-app.layout = html.Div(children=[
-    html.Div([
-        html.H1("COVID19 Web Application",
-                style={
-                    'textAlign': 'left',
-                    'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                },
-                className='ten columns',
-                ),
+# served as a function so every page load picks up the latest data generation
+@profiling.timed('serve_layout')
+def serve_layout():
+    if not context.ready():
+        return placeholder_layout()
+    colors = figures.colors
+    data = dataset.current()
+    country_index = countries.index(data)
+    days = data.series.days['confirmed']
+    # the full_table dates, of the status graph and the treemap
+    table_days = data.hierarchy.days
+    static = {graph: images.ready(data, name) for graph, name in STATIC_GRAPHS.items()}
+    return html.Div(children=[
         html.Div([
-            dbc.Button("MORE INFO", id="open", className="fa fa-info-circle",
-                       style={
-                           'color': colors['text'],
-                           'backgroundColor': colors['background'],
-                       }),
-            dbc.Modal(
-                [
-                    html.Div([
-                        dbc.ModalHeader(
-                            "Dataset provided by Johns Hopkins University Center for Systems Science and Engineering (JHU CSSE):"),
-                        html.A("https://systems.jhu.edu/"),
-                    ], style={'textAlign': 'center'}),
-                    html.Hr(),
-                    dbc.ModalBody(
-                        "SARS-CoV-2, better known as COVID-19 (coronavirus disease 2019) is a viral \
-                            infectious disease and is currently a World Health Organization (WHO) declared pandemic. \
-                                Having now killed over half a million people, this novel coronavirus that was first detected in Wuhan China, has now spread to over \
-                                    200 locations internationally. "
-                    ),
-                    html.Br(),
-                    dbc.ModalBody(
-                        "This web application intends to serve as an informative guide around the novel \
-                            coronavirus. This project was done in Python, using Plotly for the visualizations, and Dash and Flask \
-                                to build this web application. Heroku was used to host this web application."
-                    ),
-                    html.Hr(),
-                    dbc.ModalFooter(
-                        dbc.Button("Close", id="close", className="ml-auto", style={
-                            'color': colors['text'],
-                            'backgroundColor': colors['background'],
-                        })
-                    ),
-                ],
-                id="modal", className="ten columns offset-by-one",
-            ),
-        ], style={
-            'color': colors['text'],
-            'backgroundColor': colors['background'],
-        }),
-    ], className="row"),
-
-    # # Top column display of confirmed, death and recovered total numbers
-    html.Div([
-        html.Div([
-            html.H4(children='Total Confirmed: ',
+            html.H1("COVID19 Web Application",
                     style={
-                        'textAlign': 'center',
-                        'color': colors['confirmed_text'],
-                    }
-                    ),
-            html.P(f"{total_confirmed:,d}",
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['confirmed_text'],
-                       'fontSize': 30,
-                   }
-                   ),
-            html.P('Past 24hrs increase: +' + f"{total_confirmed - worldwide_confirmed[-2]:,d}" + ' (' + str(round(((total_confirmed - worldwide_confirmed[-2])/total_confirmed)*100, 2)) + '%)',
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['confirmed_text'],
-            }
-            ),
-        ],
-            style=divBorderStyle,
-            className='three columns',
-        ),
-        html.Div([
-            html.H4(children='Total Deceased: ',
-                    style={
-                        'textAlign': 'center',
-                        'color': colors['deaths_text'],
-                    }
+                        'textAlign': 'left',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                    },
+                    className='ten columns',
                     ),
-            html.P(f"{total_deaths:,d}",
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['deaths_text'],
-                       'fontSize': 30,
-                   }
-                   ),
-            html.P('Mortality Rate: ' + str(round(total_deaths/total_confirmed * 100, 3)) + '%',
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['deaths_text'],
-            }
-            ),
-        ],
-            style=divBorderStyle,
-            className='three columns'),
+            html.Div([
+                dbc.Button("MORE INFO", id="open", className="fa fa-info-circle",
+                           style={
+                               'color': colors['text'],
+                               'backgroundColor': colors['background'],
+                           }),
+                dbc.Modal(
+                    [
+                        html.Div([
+                            dbc.ModalHeader(
+                                "Dataset provided by Johns Hopkins University Center for Systems Science and Engineering (JHU CSSE):"),
+                            html.A("https://systems.jhu.edu/"),
+                        ], style={'textAlign': 'center'}),
+                        html.Hr(),
+                        dbc.ModalBody(
+                            "SARS-CoV-2, better known as COVID-19 (coronavirus disease 2019) is a viral \
+                                infectious disease and is currently a World Health Organization (WHO) declared pandemic. \
+                                    Having now killed over half a million people, this novel coronavirus that was first detected in Wuhan China, has now spread to over \
+                                        200 locations internationally. "
+                        ),
+                        html.Br(),
+                        dbc.ModalBody(
+                            "This web application intends to serve as an informative guide around the novel \
+                                coronavirus. This project was done in Python, using Plotly for the visualizations, and Dash and Flask \
+                                    to build this web application. Heroku was used to host this web application."
+                        ),
+                        html.Hr(),
+                        dbc.ModalFooter(
+                            dbc.Button("Close", id="close", className="ml-auto", style={
+                                'color': colors['text'],
+                                'backgroundColor': colors['background'],
+                            })
+                        ),
+                    ],
+                    id="modal", className="ten columns offset-by-one",
+                ),
+            ], style={
+                'color': colors['text'],
+                'backgroundColor': colors['background'],
+            }),
+        ], className="row"),
+
+        # # Top column display of confirmed, death and recovered total numbers
         html.Div([
-            html.H4(children='Total Active: ',
-                    style={
-                        'textAlign': 'center',
-                        'color': colors['active_text'],
-                    }
-                    ),
-            html.P(f"{total_active:,d}",
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['active_text'],
-                       'fontSize': 30,
-                   }
-                   ),
-            html.P('Past 24hrs increase: +' + f"{total_active - worldwide_active[-2]:,d}" + ' (' + str(round(((total_active - worldwide_active[-2])/total_active)*100, 2)) + '%)',
-                   style={
-                'textAlign': 'center',
-                       'color': colors['active_text'],
-            }
+            html.Div([
+                html.H4(children='Total Confirmed: ',
+                        style={
+                            'textAlign': 'center',
+                            'color': colors['confirmed_text'],
+                        }
+                        ),
+                html.P(f"{data.total_confirmed:,d}",
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['confirmed_text'],
+                           'fontSize': 30,
+                       }
+                       ),
+                html.P('Past 24hrs increase: +' + f"{data.new_confirmed:,d}" + ' (' + str(round((data.new_confirmed/data.total_confirmed)*100, 2)) + '%)',
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['confirmed_text'],
+                }
+                ),
+            ],
+                style=divBorderStyle,
+                className='three columns',
             ),
-        ],
-            style=divBorderStyle,
-            className='three columns',
-        ),
-        html.Div([
-            html.H4(children='Total Recovered: ',
-                    style={
-                        'textAlign': 'center',
-                        'color': colors['recovered_text'],
-                    }
-                    ),
-            html.P(f"{total_recovered:,d}",
-                   style={
-                       'textAlign': 'center',
-                       'color': colors['recovered_text'],
-                       'fontSize': 30,
-                   }
-                   ),
-            html.P('Recovery Rate: ' + str(round(worldwide_recovered[-1]/worldwide_confirmed[-1] * 100, 3)) + '%',
-                   style={
-                'textAlign': 'center',
-                'color': colors['recovered_text'],
-            }
+            html.Div([
+                html.H4(children='Total Deceased: ',
+                        style={
+                            'textAlign': 'center',
+                            'color': colors['deaths_text'],
+                        }
+                        ),
+                html.P(f"{data.total_deaths:,d}",
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['deaths_text'],
+                           'fontSize': 30,
+                       }
+                       ),
+                html.P('Mortality Rate: ' + str(round(data.total_deaths/data.total_confirmed * 100, 3)) + '%',
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['deaths_text'],
+                }
+                ),
+            ],
+                style=divBorderStyle,
+                className='three columns'),
+            html.Div([
+                html.H4(children='Total Active: ',
+                        style={
+                            'textAlign': 'center',
+                            'color': colors['active_text'],
+                        }
+                        ),
+                html.P(f"{data.total_active:,d}",
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['active_text'],
+                           'fontSize': 30,
+                       }
+                       ),
+                html.P('Past 24hrs increase: +' + f"{data.new_active:,d}" + ' (' + str(round((data.new_active/data.total_active)*100, 2)) + '%)',
+                       style={
+                    'textAlign': 'center',
+                           'color': colors['active_text'],
+                }
+                ),
+            ],
+                style=divBorderStyle,
+                className='three columns',
             ),
-        ],
-            style=divBorderStyle,
-            className='three columns'),
-    ], className='row'),
+            html.Div([
+                html.H4(children='Total Recovered: ',
+                        style={
+                            'textAlign': 'center',
+                            'color': colors['recovered_text'],
+                        }
+                        ),
+                html.P(f"{data.total_recovered:,d}",
+                       style={
+                           'textAlign': 'center',
+                           'color': colors['recovered_text'],
+                           'fontSize': 30,
+                       }
+                       ),
+                html.P('Recovery Rate: ' + str(round(data.worldwide_recovered[-1]/data.worldwide_confirmed[-1] * 100, 3)) + '%',
+                       style={
+                    'textAlign': 'center',
+                    'color': colors['recovered_text'],
+                }
+                ),
+            ],
+                style=divBorderStyle,
+                className='three columns'),
+        ], className='row'),
 
 
-    html.Div([
         html.Div([
-            dcc.Graph(figure=fig_map, style={
-                'display': 'flex',
-                'flex-direction': 'column',
-                'box-sizing': 'border-box',
-                # 'margin-left': 'auto',
-                # 'margin-right': 'auto',
-                'height': '70vh',
-                'padding': '0.75rem',
+            html.Div([
+                static_first('map_graph', static['map_graph'], [
+                    dcc.Graph(id='map_graph', style={
+                        'display': 'flex',
+                        'flex-direction': 'column',
+                        'box-sizing': 'border-box',
+                        # 'margin-left': 'auto',
+                        # 'margin-right': 'auto',
+                        'height': '70vh',
+                        'padding': '0.75rem',
+                        'textAlign': 'center',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                        'border-color': colors['background'],
+                    },
+                        className="twelve columns",
+                        # sent with the page unless its image is shown first
+                        **({} if static['map_graph'] else {'figure': figures.tab_figures.get(data, 'fig_map')})),
+                ]),
+            ], style={
                 'textAlign': 'center',
                 'color': colors['text'],
                 'backgroundColor': colors['background'],
-                'border-color': colors['background'],
-            },
-                className="twelve columns"),
-        ], style={
-            'textAlign': 'center',
-            'color': colors['text'],
-            'backgroundColor': colors['background'],
-        }),
+            }),
 
-    ], className="row"),
+        ], className="row"),
 
 
-    html.Div([
         html.Div([
-            dcc.Tabs([
-                dcc.Tab(label='Cases by Status', children=[
-                    html.Div([
-                        html.Div([
-                            html.Label(['X-axis categories to compare:'],
-                                       style={'font-weight': 'bold'}),
-                            dcc.RadioItems(
-                                id='xaxis_raditem',
-                                options=[
-                                    {'label': 'Cumulative',
-                                     'value': 'Date'},
-                                    {'label': 'Instantaneous',
-                                     'value': 'Date2'},
-                                ],
-                                value='Date',
-                                style={"width": "50%"}
-                            ),
-                        ], className="six columns"),
-
+            html.Div([
+                dcc.Tabs(id='cases_tabs', value='status', children=[
+                    dcc.Tab(label='Cases by Status', value='status', children=[
                         html.Div([
                             html.Div([
-                                html.Label(['Y-axis values to compare:'],
+                                html.Label(['X-axis categories to compare:'],
                                            style={'font-weight': 'bold'}),
                                 dcc.RadioItems(
-                                    id='yaxis_raditem',
+                                    id='xaxis_raditem',
                                     options=[
-                                        {'label': 'Linear',
-                                         'value': 'Count'},
-                                        {'label': 'Semi-log',
-                                         'value': 'Count2'},
+                                        {'label': 'Cumulative',
+                                         'value': 'Date'},
+                                        {'label': 'Instantaneous',
+                                         'value': 'Date2'},
+                                        {'label': '7-day average',
+                                         'value': 'Date3'},
                                     ],
-                                    value='Count',
+                                    value='Date',
                                     style={"width": "50%"}
                                 ),
-                            ], style={'float': 'right'}),
-                        ], className="six columns"),
-                    ], className="row"),
+                            ], className="six columns"),
 
-                    dcc.Graph(id='the_graph'),
-                    # dcc.Graph(figure=fig_area),
-                ], style={
+                            html.Div([
+                                html.Div([
+                                    html.Label(['Y-axis values to compare:'],
+                                               style={'font-weight': 'bold'}),
+                                    dcc.RadioItems(
+                                        id='yaxis_raditem',
+                                        options=[
+                                            {'label': 'Linear',
+                                             'value': 'Count'},
+                                            {'label': 'Semi-log',
+                                             'value': 'Count2'},
+                                        ],
+                                        value='Count',
+                                        style={"width": "50%"}
+                                    ),
+                                ], style={'float': 'right'}),
+                            ], className="six columns"),
+                        ], className="row"),
+
+                        # day numbers of the full_table dates, other windows are cut on the server
+                        html.Div([
+                            dcc.RangeSlider(
+                                id='status_range',
+                                min=table_days[0], max=table_days[-1], step=1,
+                                value=[table_days[0], table_days[-1]],
+                                marks=month_marks(table_days),
+                                allowCross=False,
+                                updatemode='mouseup',
+                            ),
+                        ], style={'padding': '20px 30px 0px 30px'}),
+                        dcc.Graph(id='the_graph'),
+                        # every x-axis variant of the whole range ships with the page, the radios are
+                        # handled in the browser
+                        dcc.Store(id='status_figures', data={
+                            x_axis: figures.status_figures.get(data, x_axis)
+                            for x_axis in figures.STATUS_AXES}),
+                        # dcc.Graph(figure=fig_area),
+                    ], style={
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'], }),
+                    dcc.Tab(label='Cases by Time', value='time', children=[
+                        static_first('line_graph', static['line_graph'], [
+                            # day numbers, the graph is cut to the window on the server
+                            html.Div([
+                                dcc.RangeSlider(
+                                    id='date_range',
+                                    min=days[0], max=days[-1], step=1,
+                                    value=[days[0], days[-1]],
+                                    marks=month_marks(days),
+                                    allowCross=False,
+                                    updatemode='mouseup',
+                                ),
+                            ], style={'padding': '20px 30px 0px 30px'}),
+                            dcc.Graph(id='line_graph'),
+                        ]),
+                    ], style={
+                        'color': colors['text'],
+                        'backgroundColor':colors['background'], }),
+                    dcc.Tab(label='Cases by Country', value='country', children=[
+                        static_first('tree_graph', static['tree_graph'], [
+                            # any case at any date, cut from the province rollup on the server
+                            html.Div([
+                                html.Div([
+                                    dcc.RadioItems(
+                                        id='tree_case',
+                                        options=[{'label': case, 'value': case}
+                                                 for case in dataset.cases],
+                                        value='Confirmed',
+                                        labelStyle={'display': 'inline-block'},
+                                    ),
+                                ], className="six columns"),
+                                html.Div([
+                                    dcc.RadioItems(
+                                        id='tree_kind',
+                                        options=[{'label': 'Treemap', 'value': 'treemap'},
+                                                 {'label': 'Sunburst', 'value': 'sunburst'}],
+                                        value='treemap',
+                                        labelStyle={'display': 'inline-block'},
+                                    ),
+                                ], className="six columns"),
+                            ], className="row"),
+                            html.Div([
+                                dcc.Slider(
+                                    id='tree_date',
+                                    min=table_days[0], max=table_days[-1], step=1,
+                                    value=table_days[-1],
+                                    marks=month_marks(table_days),
+                                    updatemode='mouseup',
+                                ),
+                            ], style={'padding': '20px 30px 0px 30px'}),
+                            dcc.Graph(id='tree_graph'),
+                        ]),
+                    ], style={
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'], }, ),
+                    dcc.Tab(label='Country Details', value='details', children=[
+                        dcc.Dropdown(
+                            id='country_dropdown',
+                            options=[{'label': name, 'value': name}
+                                     for name in country_index.names],
+                            value=country_index.largest,
+                            clearable=False,
+                            style={'color': '#000000'},
+                        ),
+                        dcc.Graph(id='country_graph'),
+                    ], style={
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'], }, ),
+                ], style={'padding-top': '2rem'},)
+            ], className="six columns"),
+
+            html.Div([
+                # bar chart race of the confirmed cases, cached per version of the confirmed file and
+                # loaded after the page like the tab figures
+                dcc.Graph(id='race_graph', style={
+                    'height': '100vh',
+                    'width': '100%',
                     'color': colors['text'],
-                    'backgroundColor': colors['background'], }),
-                dcc.Tab(label='Cases by Time', children=[
-                    dcc.Graph(figure=fig_line),
+                    'backgroundColor': colors['background'],
+                }),
+            ], className="six columns"),
+
+        ], className="row"),
+
+
+        html.Div([
+            html.H2("Evaluation of Population Census Data"),
+            dcc.Tabs(id='census_tabs', value='gapminder', children=[
+                dcc.Tab(label='Life expectancy vs. GDP per capita', value='gapminder', children=[
+                    dcc.Graph(id='gapminder_graph', style={
+                        'width': '100%',
+                        'height': '90vh',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                        'border-color': colors['background'],
+                    },
+                        className="twelve columns"),
                 ], style={
                     'color': colors['text'],
                     'backgroundColor':colors['background'], }),
-                dcc.Tab(label='Cases by Country', children=[
-                    dcc.Graph(figure=fig_tree),
+
+                dcc.Tab(label='Scatter Matrix', value='matrix', children=[
+                    dcc.Graph(id='matrix_graph', style={
+                        'width': '100%',
+                        'height': '90vh',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                        'border-color': colors['background'],
+                    },
+                        className="twelve columns"),
                 ], style={
                     'color': colors['text'],
-                    'backgroundColor': colors['background'], }, ),
-            ], style={'padding-top': '2rem'},)
-        ], className="six columns"),
+                    'backgroundColor':colors['background'], }),
 
-        html.Div([
-            html.Iframe(
-                style={
-                    # 'display': 'block',
-                    # 'flex-direction': 'column',
-                    # 'box-sizing': 'border-box',
-                    # 'margin': 'auto',
-                    'height': '100vh',
-                    'width': '100%',
-                    # 'padding-top': '10rem',
-                    # 'padding': '0.75rem',
+                dcc.Tab(label='Scatter Plot', value='scatter', children=[
+                    dcc.Graph(id='scatter_graph', style={
+                        'width': '100%',
+                        'height': '90vh',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                        'border-color': colors['background'],
+                    },
+                        className="twelve columns"),
+                ], style={
                     'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                    'border-style': 'none',
-
-                },
-                # className="row",
-                srcDoc='''
-                <div class="flourish-embed flourish-bar-chart-race" data-src="visualisation/1571387">
-                    <script src="https://public.flourish.studio/resources/embed.js"></script>
-                </div>
-                '''
-            ),
-        ], className="six columns"),
+                    'backgroundColor':colors['background'], }),
 
-    ], className="row"),
+            ]),
+        ], className="row"),
+
+    ], style={
+        'textAlign': 'left',
+        'color': colors['text'],
+        'backgroundColor': colors['background'],
+        'margin-top': '0',
+        'width': '100%'
+    },)
+
+
+# Tab figures are generated (and cached as JSON) on the server the first time their tab
+# is selected instead of shipping with the initial layout. The response is stored
+# serialized and compressed, the regular callback only answers the other tabs.
+# graph id -> (tabs id, tab value, figure name)
+TAB_GRAPHS = {
+    'gapminder_graph': ('census_tabs', 'gapminder', 'fig_scatter'),
+    'matrix_graph': ('census_tabs', 'matrix', 'fig_matrix'),
+    'scatter_graph': ('census_tabs', 'scatter', 'fig_scatter2'),
+}
 
 
-    html.Div([
-        html.H2("Evaluation of Population Census Data"),
-        dcc.Tabs([
-            dcc.Tab(label='Life expectancy vs. GDP per capita', children=[
-                dcc.Graph(figure=fig_scatter, style={
-                    'width': '100%',
-                    'height': '90vh',
-                    'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                    'border-color': colors['background'],
-                },
-                    className="twelve columns"),
-            ], style={
-                'color': colors['text'],
-                'backgroundColor':colors['background'], }),
+def tab_figure_callback(tab_value, name):
+    def load_figure(tab, hydrated=-1):
+        # hydrated is 0 while the graph's static image is shown
+        if tab != tab_value or hydrated == 0:
+            raise PreventUpdate
+        return figures.tab_figures.get(dataset.current(), name)
+    return load_figure
 
-            dcc.Tab(label='Scatter Matrix', children=[
-                dcc.Graph(figure=fig_matrix, style={
-                    'width': '100%',
-                    'height': '90vh',
-                    'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                    'border-color': colors['background'],
-                },
-                    className="twelve columns"),
-            ], style={
-                'color': colors['text'],
-                'backgroundColor':colors['background'], }),
 
-            dcc.Tab(label='Scatter Plot', children=[
-                dcc.Graph(figure=fig_scatter2, style={
-                    'width': '100%',
-                    'height': '90vh',
-                    'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                    'border-color': colors['background'],
-                },
-                    className="twelve columns"),
-            ], style={
-                'color': colors['text'],
-                'backgroundColor':colors['background'], }),
+def full_range(data, date_range, days=None):
+    days = data.series.days['confirmed'] if days is None else days
+    return not date_range or (date_range[0] <= days[0] and date_range[1] >= days[-1])
+
 
-        ]),
-    ], className="row"),
+def tree_default(data, case, kind, day):
+    # the cached fig_tree is the confirmed cases' treemap at the latest date
+    return (case, kind) == ('Confirmed', 'treemap') and (day is None or day >= data.hierarchy.days[-1])
 
-], style={
-    'textAlign': 'left',
-    'color': colors['text'],
-    'backgroundColor': colors['background'],
-    'margin-top': '0',
-    'width': '100%'
-},)
 
-print("Here 17")
 # ------------------------------------------------------------------------------
-# Connect the Plotly graphs with Dash Components
-# @app.callback()
-
-
-@app.callback(
-    Output("modal", "is_open"),
-    [Input("open", "n_clicks"), Input("close", "n_clicks")],
-    [State("modal", "is_open")],
-)
-def toggle_modal(n1, n2, is_open):
-    if n1 or n2:
-        return not is_open
-    return is_open
-
-
-@app.callback(
-    Output(component_id='the_graph', component_property='figure'),
-    [Input(component_id='xaxis_raditem', component_property='value'),
-     Input(component_id='yaxis_raditem', component_property='value')]
-)
-def update_graph(x_axis, y_axis):
-    dff = temp
-    dff2 = full_table.groupby(
-        'Date')['Recovered', 'Deaths', 'Active'].sum().diff()
-    dff2 = dff2.reset_index()
-    dff2 = dff2.melt(id_vars="Date",
-                     value_vars=['Recovered', 'Deaths', 'Active'])
-    if x_axis == "Date":
-        if y_axis == "Count":
-            fig = px.area(
-                data_frame=dff,
-                x=x_axis,
-                y=y_axis,
-                title=y_axis+': by '+x_axis,
-                color='Case',
-                color_discrete_sequence=["green", "red", "#ffa500"],
-            )
-
-            fig.update_layout(
-                xaxis={'categoryorder': 'total ascending'},
-                title={'xanchor': 'center',
-                       'yanchor': 'top', 'y': 0.9, 'x': 0.5, },
-                margin={'l': 0, 'r': 0, 'b': 0},
-                plot_bgcolor=colors['background'],
-                paper_bgcolor=colors['background'],
-                font_color=colors['text']
-            ),
-        else:
-            fig = px.area(
-                data_frame=dff,
-                x=x_axis,
-                y="Count",
-                title=y_axis+': by '+x_axis,
-                color='Case',
-                color_discrete_sequence=["green", "red", "#ffa500"],
-            )
-
-            fig.update_layout(
-                yaxis_type="log",
-                xaxis={'categoryorder': 'total ascending'},
-                title={'xanchor': 'center',
-                       'yanchor': 'top', 'y': 0.9, 'x': 0.5, },
-                margin={'l': 0, 'r': 0, 'b': 0},
-                plot_bgcolor=colors['background'],
-                paper_bgcolor=colors['background'],
-                font_color=colors['text']
-            ),
-    else:
-        if y_axis == "Count":
-            fig = px.bar(dff2, x="Date", y="value", color='variable',
-                         title=y_axis+': by '+x_axis,
-                         color_discrete_sequence=["green", "red", "#ffa500"])
-            fig.update_layout(barmode='group')
-            fig.update_layout(
-                xaxis={'categoryorder': 'total ascending'},
-                title={'xanchor': 'center',
-                       'yanchor': 'top', 'y': 0.9, 'x': 0.5, },
-                margin={'l': 0, 'r': 0, 'b': 0},
-                plot_bgcolor=colors['background'],
-                paper_bgcolor=colors['background'],
-                font_color=colors['text'],
-            )
-        else:
-            fig = px.bar(dff2, x="Date", y="value", color='variable',
-                         title=y_axis+': by '+x_axis,
-                         color_discrete_sequence=["green", "red", "#ffa500"])
-            fig.update_layout(barmode='group', yaxis_type="log")
-            fig.update_layout(
-                xaxis={'categoryorder': 'total ascending'},
-                title={'xanchor': 'center',
-                       'yanchor': 'top', 'y': 0.9, 'x': 0.5, },
-                margin={'l': 0, 'r': 0, 'b': 0},
-                plot_bgcolor=colors['background'],
-                paper_bgcolor=colors['background'],
-                font_color=colors['text'],
-            )
-    return fig
 
+def register_callbacks(app):
+    # Connect the Plotly graphs with Dash Components
+    # @app.callback()
+
+    @app.callback(
+        Output("modal", "is_open"),
+        [Input("open", "n_clicks"), Input("close", "n_clicks")],
+        [State("modal", "is_open")],
+    )
+    @profiling.timed('toggle_modal')
+    def toggle_modal(n1, n2, is_open):
+        if n1 or n2:
+            return not is_open
+        return is_open
+
+    # Cumulative/Instantaneous/7-day average and Linear/Semi-log only pick a prebuilt figure and set the
+    # y axis type, see assets/clientside.js
+    app.clientside_callback(
+        ClientsideFunction(namespace='status', function_name='update_graph'),
+        Output(component_id='the_graph', component_property='figure'),
+        [Input(component_id='xaxis_raditem', component_property='value'),
+         Input(component_id='yaxis_raditem', component_property='value'),
+         Input(component_id='status_figures', component_property='data')]
+    )
+
+    # other status windows are cut and downsampled per request, every x-axis variant at once
+    @app.callback(Output('status_figures', 'data'), [Input('status_range', 'value')])
+    @profiling.timed('status_figures')
+    def update_status_figures(status_range):
+        data = dataset.current()
+        if full_range(data, status_range, data.hierarchy.days):
+            if not any(trigger['value'] for trigger in callback_context.triggered):
+                # the initial call, the page came with them
+                raise PreventUpdate
+            return {x_axis: figures.status_figures.get(data, x_axis) for x_axis in figures.STATUS_AXES}
+        return {x_axis: figures.status_figure(data, x_axis, *status_range) for x_axis in figures.STATUS_AXES}
+
+    @app.callback(
+        Output('country_graph', 'figure'),
+        [Input('country_dropdown', 'value')],
+    )
+    @profiling.timed('country_graph')
+    def update_country(country):
+        detail = countries.index(dataset.current()).lookup(country)
+        if detail is None:
+            raise PreventUpdate
+        return figures.country_figure(detail)
+
+    def country_payload(country):
+        # the same figure as stored bytes, every country is encoded once per generation
+        data = dataset.current()
+        if country not in countries.index(data):
+            return None
+        return app.payloads.get('country_graph:' + country, data.version, lambda: serving.callback_body(
+            'country_graph', 'figure', serving.encode(figures.country_figure(countries.index(data).lookup(country)))))
+
+    app.payload_callback('country_graph.figure', profiling.timed('country_graph')(country_payload))
+
+    def tab_figure_payload(graph, tab_value, name):
+        def load_payload(tab, hydrated=-1):
+            if tab != tab_value or hydrated == 0:
+                return None
+            data = dataset.current()
+            return app.payloads.get(graph, figures.tab_figures.stamp(data, name), lambda: serving.callback_body(
+                graph, 'figure', figures.tab_figures.json(data, name).encode('utf-8')))
+        return load_payload
+
+    for graph, (tabs, tab_value, name) in TAB_GRAPHS.items():
+        inputs = [Input(tabs, 'value')]
+        if graph in STATIC_GRAPHS:
+            inputs.append(Input(graph + '_hydrate', 'n_clicks'))
+        app.callback(Output(graph, 'figure'), inputs)(
+            profiling.timed(graph)(tab_figure_callback(tab_value, name)))
+        app.payload_callback(graph + '.figure', profiling.timed(graph)(
+            tab_figure_payload(graph, tab_value, name)))
+
+    # the bar chart race is not in a tab, it loads once with the page: the graph's id, its
+    # input, never changes after the initial call
+    app.callback(Output('race_graph', 'figure'), [Input('race_graph', 'id')])(
+        profiling.timed('race_graph')(tab_figure_callback('race_graph', 'fig_race')))
+    app.payload_callback('race_graph.figure', profiling.timed('race_graph')(
+        tab_figure_payload('race_graph', 'race_graph', 'fig_race')))
+
+    # Cases by Time is a tab figure too, other date windows are cut and downsampled per request
+    @app.callback(
+        Output('line_graph', 'figure'),
+        [Input('cases_tabs', 'value'),
+         Input('date_range', 'value'),
+         Input('line_graph_hydrate', 'n_clicks')],
+    )
+    @profiling.timed('line_graph')
+    def update_line_graph(tab, date_range, hydrated):
+        if tab != 'time' or hydrated == 0:
+            raise PreventUpdate
+        data = dataset.current()
+        if full_range(data, date_range):
+            return figures.tab_figures.get(data, 'fig_line')
+        return figures.line_figure(data, *date_range)
+
+    def line_payload(tab, date_range, hydrated):
+        if tab != 'time' or hydrated == 0 or not full_range(dataset.current(), date_range):
+            return None
+        return tab_figure_payload('line_graph', 'time', 'fig_line')(tab)
+
+    app.payload_callback('line_graph.figure', profiling.timed('line_graph')(line_payload))
+
+    # Cases by Country is a tab figure too, other cases, dates and the sunburst are cut from
+    # the province rollup per request
+    @app.callback(
+        Output('tree_graph', 'figure'),
+        [Input('cases_tabs', 'value'),
+         Input('tree_case', 'value'),
+         Input('tree_kind', 'value'),
+         Input('tree_date', 'value'),
+         Input('tree_graph_hydrate', 'n_clicks')],
+    )
+    @profiling.timed('tree_graph')
+    def update_tree_graph(tab, case, kind, day, hydrated):
+        if tab != 'country' or hydrated == 0:
+            raise PreventUpdate
+        data = dataset.current()
+        if tree_default(data, case, kind, day):
+            return figures.tab_figures.get(data, 'fig_tree')
+        if case not in dataset.cases or kind not in ('treemap', 'sunburst'):
+            raise PreventUpdate
+        return figures.tree_figure(data, case, day, kind)
+
+    def tree_payload(tab, case, kind, day, hydrated):
+        if tab != 'country' or hydrated == 0 or not tree_default(dataset.current(), case, kind, day):
+            return None
+        return tab_figure_payload('tree_graph', 'country', 'fig_tree')(tab)
+
+    app.payload_callback('tree_graph.figure', profiling.timed('tree_graph')(tree_payload))
+
+    # The static images swap for their graphs in the browser (see assets/clientside.js), the
+    # figures then load like tab figures. The map's is otherwise sent with the page
+    for graph in STATIC_GRAPHS:
+        app.clientside_callback(
+            ClientsideFunction(namespace='images', function_name='static_style'),
+            Output(graph + '_static', 'style'),
+            [Input(graph + '_hydrate', 'n_clicks')])
+        app.clientside_callback(
+            ClientsideFunction(namespace='images', function_name='interactive_style'),
+            Output(graph + '_interactive', 'style'),
+            [Input(graph + '_hydrate', 'n_clicks')])
+
+    def map_payload(hydrated):
+        if not hydrated or hydrated < 0:
+            return None
+        data = dataset.current()
+        return app.payloads.get('map_graph', figures.tab_figures.stamp(data, 'fig_map'), lambda: serving.callback_body(
+            'map_graph', 'figure', figures.tab_figures.json(data, 'fig_map').encode('utf-8')))
+
+    @app.callback(Output('map_graph', 'figure'), [Input('map_graph_hydrate', 'n_clicks')])
+    @profiling.timed('map_graph')
+    def update_map_graph(hydrated):
+        if not hydrated or hydrated < 0:
+            raise PreventUpdate
+        return figures.tab_figures.get(dataset.current(), 'fig_map')
+
+    app.payload_callback('map_graph.figure', profiling.timed('map_graph')(map_payload))
+
+    # the placeholder page reloads once the data is there
+    @app.callback(Output('placeholder_location', 'href'), [Input('placeholder_interval', 'n_intervals')])
+    def reload_when_ready(n_intervals):
+        if not context.ready():
+            raise PreventUpdate
+        return app.config.requests_pathname_prefix
+
+
+def layout_stamp():
+    # the data generation and which of its static images are rendered, they are rendered
+    # after the generation is published so a layout built before them is built again
+    if not context.ready():
+        return -1
+    data = dataset.current()
+    return (data.version,) + tuple(images.ready(data, name) is not None for name in STATIC_GRAPHS.values())
+
+
+def start_loading():
+    # context.start looked up per request, the tests keep the data from loading
+    context.start()
+
+
+def create_app():
+    """The Dash app with its routes and callbacks, the data is loaded by context.start()."""
+    # the layout is serialized and compressed once per data generation (see serving.py), the
+    # placeholder shown while loading has none of the callbacks' components
+    app = serving.Dash(__name__, external_stylesheets=external_stylesheets,
+                       layout_stamp=layout_stamp, suppress_callback_exceptions=True)
+    app.layout = serve_layout
+    # started per worker (threads do not survive the gunicorn --preload fork), gunicorn.conf.py
+    # starts it right after the fork
+    app.server.before_request(start_loading)
+    register_routes(app)
+    register_callbacks(app)
+    return app
+
+
+app = create_app()
+server = app.server
 
 # ---------------------------------------------------------------------------------------------
 if __name__ == '__main__':
+    context.start()
     app.run_server(debug=True)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Shared-memory arena for the cleaned data frames.
+
+The frames every other frame is derived from (dataset.FRAMES) are written to a
+generation directory on tmpfs and read back as read-only memory maps, so every
+gunicorn worker maps the same pages instead of holding its own copy. Runs of
+consecutive same-dtype numeric columns are stored as one 2-D array each, which
+pandas wraps without copying; string columns stay private to each worker.
+
+Only one worker refreshes from upstream at a time (the one holding the arena
+lock). It writes a new generation and points current.json at it, the other
+workers attach to that generation and only recompute the small derived frames.
+The figures built for a generation are saved next to it (figure_directory), the
+other workers load them instead of building them again.
+
+Environment:
+    COVID19_SHARED_MEMORY  set to 0 to keep all data private to each process
+    COVID19_ARENA_DIR      where generations are written (default /dev/shm/covid19)
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import dataset
+import profiling
+
+SHARED_MEMORY = os.environ.get('COVID19_SHARED_MEMORY', '1') != '0'
+ARENA_DIR = os.environ.get('COVID19_ARENA_DIR') or (
+    '/dev/shm/covid19' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'covid19-arena'))
+
+# generations kept on disk, older ones may still be mapped by slow workers
+KEEP_GENERATIONS = 3
+
+
+# ---------------------------------------------------------------------------------------------
+# frames
+
+def _kind(series):
+    if series.dtype == object or pd.api.types.is_categorical_dtype(series.dtype):
+        return 'object'
+    return series.dtype.str
+
+
+def write_frame(directory, name, df):
+    """Write df into directory, returns the manifest entry to read it back."""
+    kinds = [_kind(df.iloc[:, i]) for i in range(df.shape[1])]
+    runs = []
+    start = 0
+    for i in range(1, len(kinds) + 1):
+        if i == len(kinds) or kinds[i] != kinds[start]:
+            runs.append((start, i))
+            start = i
+
+    entries = []
+    for n, (start, stop) in enumerate(runs):
+        entry = {'file': '%s.%d.npy' % (name, n), 'columns': list(df.columns[start:stop])}
+        block = df.iloc[:, start:stop]
+        if kinds[start] == 'object':
+            # string columns as int32 codes, -1 is NaN
+            entry['categories'] = []
+            entry['categorical'] = []
+            codes = []
+            for column in entry['columns']:
+                categorical = pd.Categorical(block[column])
+                entry['categories'].append([str(c) for c in categorical.categories])
+                entry['categorical'].append(block[column].dtype != object)
+                codes.append(categorical.codes.astype(np.int32))
+            values = np.vstack(codes)
+        else:
+            # stored column-major, so the frame block is a plain view of the map
+            values = np.ascontiguousarray(block.to_numpy().T)
+        np.save(os.path.join(directory, entry['file']), values, allow_pickle=False)
+        entries.append(entry)
+    return {'rows': len(df), 'runs': entries}
+
+
+def read_frame(directory, entry):
+    """Frame whose numeric blocks are read-only memory maps of the arena."""
+    pieces = []
+    for run in entry['runs']:
+        values = np.load(os.path.join(directory, run['file']), mmap_mode='r')
+        if 'categories' in run:
+            columns = {}
+            for column, codes, categories, categorical in zip(
+                    run['columns'], values, run['categories'], run['categorical']):
+                columns[column] = pd.Categorical.from_codes(codes, categories)
+                if not categorical:
+                    columns[column] = columns[column].astype(object)
+            pieces.append(pd.DataFrame(columns, columns=run['columns']))
+        else:
+            pieces.append(pd.DataFrame(values.T, columns=run['columns'], copy=False))
+    if not pieces:
+        return pd.DataFrame(index=pd.RangeIndex(entry['rows']))
+    return pd.concat(pieces, axis=1, copy=False)
+
+
+# ---------------------------------------------------------------------------------------------
+# generations
+
+def _manifest_path():
+    return os.path.join(ARENA_DIR, 'current.json')
+
+
+def latest():
+    """Manifest of the newest shared generation, None if there is none."""
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest):
+    tmp = _manifest_path() + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_path())
+
+
+def touch():
+    """Record that upstream was checked and nothing changed."""
+    manifest = latest()
+    if manifest is not None:
+        manifest['checked_at'] = time.time()
+        _write_manifest(manifest)
+
+
+@contextlib.contextmanager
+def locked():
+    """Held by the worker refreshing or publishing a generation."""
+    os.makedirs(ARENA_DIR, exist_ok=True)
+    with open(os.path.join(ARENA_DIR, 'refresh.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _prune(current):
+    generations = sorted((entry for entry in os.listdir(ARENA_DIR) if entry.startswith('g')),
+                         key=lambda entry: os.path.getmtime(os.path.join(ARENA_DIR, entry)))
+    for entry in generations[:-KEEP_GENERATIONS]:
+        if entry != current:
+            shutil.rmtree(os.path.join(ARENA_DIR, entry), ignore_errors=True)
+
+
+@profiling.phase('share')
+def share(data):
+    """
+    Write the frames of data as a new shared generation and swap them for
+    their memory-mapped versions. Call with the arena locked.
+    """
+    if not SHARED_MEMORY:
+        return data
+    os.makedirs(ARENA_DIR, exist_ok=True)
+    name = 'g%d-%d-%d' % (data.version, os.getpid(), int(time.time() * 1000))
+    directory = os.path.join(ARENA_DIR, name)
+    os.makedirs(directory)
+
+    frames = {attribute: write_frame(directory, attribute, getattr(data, attribute))
+              for attribute in dataset.FRAMES}
+    _write_manifest({
+        'directory': name,
+        'version': data.version,
+        'digests': data.digests,
+        'changed_at': data.changed_at,
+        'checked_at': time.time(),
+        'frames': frames,
+    })
+    for attribute, entry in frames.items():
+        setattr(data, attribute, read_frame(directory, entry))
+    _prune(name)
+    return data
+
+
+def figure_directory(manifest=None):
+    """
+    Directory of the figures built for a shared generation (the latest by
+    default), None without shared memory.
+    """
+    if not SHARED_MEMORY:
+        return None
+    manifest = manifest or latest()
+    if manifest is None:
+        return None
+    directory = os.path.join(ARENA_DIR, manifest['directory'], 'figures')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@profiling.phase('attach')
+def attach(manifest, previous=None):
+    """Generation built from a shared manifest, the one after previous."""
+    data = previous.derive() if previous is not None else dataset.Dataset()
+    data.version = manifest['version']
+    data.digests = dict(manifest['digests'])
+    data.changed_at = dict(manifest['changed_at'])
+    directory = os.path.join(ARENA_DIR, manifest['directory'])
+    for attribute, entry in manifest['frames'].items():
+        setattr(data, attribute, read_frame(directory, entry))
+    return dataset.derive_all(data)
@@ -0,0 +1,31 @@
+// Dash clientside callbacks, run in the browser without a server round-trip
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    status: {
+        // figures holds the prebuilt 'Date' (cumulative), 'Date2' (instantaneous) and
+        // 'Date3' (7-day average) figures
+        update_graph: function (x_axis, y_axis, figures) {
+            var figure = figures[x_axis];
+            var yaxis = Object.assign({}, figure.layout.yaxis);
+            if (y_axis === 'Count') {
+                delete yaxis.type;
+            } else {
+                yaxis.type = 'log';
+            }
+            var layout = Object.assign({}, figure.layout, {
+                yaxis: yaxis,
+                title: Object.assign({}, figure.layout.title, { text: y_axis + ': by ' + x_axis }),
+            });
+            return { data: figure.data, layout: layout };
+        },
+    },
+    images: {
+        // n_clicks of a graph's "Interactive" button: 0 while its static image is shown,
+        // -1 when the page came without an image
+        static_style: function (n_clicks) {
+            return n_clicks === 0 ? {} : { display: 'none' };
+        },
+        interactive_style: function (n_clicks) {
+            return n_clicks === 0 ? { display: 'none' } : {};
+        },
+    },
+});
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Benchmarks of the data pipeline, the figures and the callbacks.
+
+    python3 benchmark.py                            # 1x, 5x and 20x, results in benchmark.json
+    python3 benchmark.py --scales 1 5 --repeat 5 --output before.json
+
+Synthetic sources are generated for every scale: the region count and date
+range of the JHU files when the app was written, both multiplied by the scale.
+They are written once under --data-dir and reused, so runs on different
+commits measure the same input. Every scale runs in its own process, from an
+empty snapshot store and with shared memory and the refresh thread off.
+
+Stages recorded per scale (seconds, resident memory and its change):
+    startup     the phases the app logs while booting (download, parse, clean,
+                aggregate, figures... see profiling.py), the app import and the
+                background data load included
+    extend      appending one new date to the JHU series (the daily refresh)
+    analytics   the rolling statistics of every country and the world, in full
+    figure      every figure builder, and to_json of its result
+    layout      GET /_dash-layout
+    callback    every server callback through the Dash endpoint, cold and cached
+    update_graph  the clientside status callback for every input combination,
+                run with node when it is installed
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# the JHU global files around July 2020
+BASE_REGIONS = 266
+BASE_DATES = 180
+BASE_LOCATIONS = 210
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------------------------
+# synthetic sources
+
+def _cumulative(rng, rows, columns, scale):
+    # non-decreasing counts, a tenth of the regions large enough for the country filters
+    steps = rng.poisson(rng.gamma(0.5, 40, size=(rows, 1)), size=(rows, columns))
+    steps[rng.rand(rows) < 0.1] *= 100
+    return steps.cumsum(axis=1) * scale
+
+
+def generate(directory, scale, seed=0):
+    """Write the five sources at scale into directory."""
+    import datastore
+
+    rng = np.random.RandomState(seed)
+    regions = BASE_REGIONS * scale
+    dates = pd.date_range('2020-01-22', periods=BASE_DATES * scale)
+    labels = ['%d/%d/%s' % (date.month, date.day, date.strftime('%y')) for date in dates]
+
+    # about a quarter of the countries are split into provinces
+    countries = np.array(['Country %04d' % i for i in rng.randint(0, int(regions * 0.75), regions)], dtype=object)
+    countries[0] = 'Mainland China'
+    provinces = np.where(pd.Series(countries).duplicated(keep=False),
+                         ['Province %05d' % i for i in range(regions)], None)
+    lat = rng.uniform(-60, 70, regions).round(4)
+    lon = rng.uniform(-180, 180, regions).round(4)
+
+    confirmed = _cumulative(rng, regions, len(dates), 1)
+    deaths = confirmed // rng.randint(15, 40, size=(regions, 1))
+    recovered = confirmed // rng.randint(2, 4, size=(regions, 1))
+    for name, values in (('confirmed', confirmed), ('deaths', deaths), ('recovered', recovered)):
+        frame = pd.DataFrame(values, columns=labels)
+        frame.insert(0, 'Long', lon)
+        frame.insert(0, 'Lat', lat)
+        frame.insert(0, 'Country/Region', countries)
+        frame.insert(0, 'Province/State', provinces)
+        frame.to_csv(os.path.join(directory, datastore.SOURCES[name]['file']), index=False)
+
+    # the cleaned daily table, one row per region and date
+    full_table = pd.DataFrame({
+        'Province/State': np.tile(provinces, len(dates)),
+        'Country/Region': np.tile(countries, len(dates)),
+        'Lat': np.tile(lat, len(dates)),
+        'Long': np.tile(lon, len(dates)),
+        'Date': np.repeat(dates.strftime('%Y-%m-%d'), regions),
+        'Confirmed': confirmed.T.ravel(),
+        'Deaths': deaths.T.ravel(),
+        'Recovered': recovered.T.ravel(),
+    })
+    full_table['Active'] = full_table['Confirmed'] - full_table['Deaths'] - full_table['Recovered']
+    full_table['WHO Region'] = 'Region'
+    full_table.to_csv(os.path.join(directory, datastore.SOURCES['full_table']['file']), index=False)
+
+    # OWID, one row per location and date, the aggregates (World...) have no continent
+    locations = BASE_LOCATIONS * scale
+    continent = np.array(['Africa', 'Asia', 'Europe', 'North America', 'Oceania',
+                          'South America'])[rng.randint(0, 6, locations)].astype(object)
+    continent[-5:] = None
+    rows = locations * len(dates)
+    total_deaths = _cumulative(rng, locations, len(dates), 1).ravel().astype(float)
+    demographic = pd.DataFrame({
+        'iso_code': np.repeat(['L%05d' % i for i in range(locations)], len(dates)),
+        'continent': np.repeat(continent, len(dates)),
+        'location': np.repeat(['Location %05d' % i for i in range(locations)], len(dates)),
+        'date': np.tile(dates.strftime('%Y-%m-%d'), locations),
+        'total_cases': total_deaths * 20,
+        'new_cases': rng.poisson(100, rows).astype(float),
+        'total_deaths': total_deaths,
+        'new_deaths': rng.poisson(5, rows).astype(float),
+        'total_deaths_per_million': (total_deaths / 50).round(3),
+        'population': np.repeat(rng.randint(10 ** 5, 10 ** 9, locations), len(dates)).astype(float),
+        'gdp_per_capita': np.repeat(rng.uniform(500, 100000, locations).round(3), len(dates)),
+        'hospital_beds_per_thousand': np.repeat(rng.uniform(0.1, 13, locations).round(3), len(dates)),
+        'handwashing_facilities': np.repeat(rng.uniform(1, 100, locations).round(3), len(dates)),
+        'life_expectancy': np.repeat(rng.uniform(50, 85, locations).round(2), len(dates)),
+        'median_age': np.repeat(rng.uniform(15, 48, locations).round(1), len(dates)),
+        'tests_units': 'tests performed',
+    })
+    demographic.to_csv(os.path.join(directory, datastore.SOURCES['demographic']['file']), index=False)
+
+
+def fixtures(data_dir, scale):
+    """Directory with the sources at scale, generated on first use."""
+    directory = os.path.join(data_dir, 'x%d' % scale)
+    if not os.path.exists(os.path.join(directory, 'done')):
+        print("Generating %dx sources in %s" % (scale, directory), flush=True)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        generate(directory, scale)
+        open(os.path.join(directory, 'done'), 'w').close()
+    return directory
+
+
+# ---------------------------------------------------------------------------------------------
+# measuring
+
+def measure(stages, stage, function, repeat=1, **info):
+    """Run function repeat times, record the timings under stage, return its last result."""
+    import profiling
+
+    seconds = []
+    memory = profiling.rss()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    record = collections.OrderedDict([('stage', stage)])
+    record.update(info)
+    record['seconds'] = round(min(seconds), 4)
+    record['median_seconds'] = round(statistics.median(seconds), 4)
+    record['runs'] = repeat
+    record['rss_mb'] = round(profiling.rss() / 2 ** 20, 1)
+    record['rss_delta_mb'] = round(record['rss_mb'] - memory / 2 ** 20, 1)
+    if isinstance(result, (str, bytes)):
+        record['bytes'] = len(result)
+    stages.append(record)
+    return result
+
+
+def _post(client, output, inputs, state=()):
+    component, prop = output.split('.')
+    response = client.post('/_dash-update-component', json={
+        'output': output, 'outputs': {'id': component, 'property': prop},
+        'inputs': inputs, 'changedPropIds': [], 'state': list(state)})
+    return response.data
+
+
+def _next_dates(data):
+    # one more day of counts for every JHU file, the shape of a daily refresh
+    import dataset
+
+    new_dates = {}
+    for name, attribute in dataset.JHU_FRAMES.items():
+        frame = getattr(data, attribute)
+        last = pd.to_datetime(frame.columns[-1], format='%m/%d/%y') + pd.Timedelta(days=1)
+        label = '%d/%d/%s' % (last.month, last.day, last.strftime('%y'))
+        new_dates[name] = pd.DataFrame({label: np.asarray(frame.iloc[:, -1]) + 1})
+    return new_dates
+
+
+def _update_graph(store, repeat):
+    """Time the clientside status callback in node, None without node."""
+    node = shutil.which('node')
+    if node is None:
+        return None
+    script = """
+global.window = {};
+require(process.argv[1]);
+const store = JSON.parse(require('fs').readFileSync(process.argv[2]));
+const repeat = parseInt(process.argv[3]);
+const update = window.dash_clientside.status.update_graph;
+const out = [];
+for (const x of Object.keys(store)) for (const y of ['Count', 'Count2']) {
+    const times = [];
+    for (let i = 0; i < repeat; i++) {
+        const start = process.hrtime.bigint();
+        JSON.stringify(update(x, y, store));
+        times.push(Number(process.hrtime.bigint() - start) / 1e9);
+    }
+    out.push({x_axis: x, y_axis: y, seconds: Math.min(...times)});
+}
+console.log(JSON.stringify(out));
+"""
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        json.dump(store, f)
+        f.flush()
+        output = subprocess.check_output(
+            [node, '-e', script, os.path.join(HERE, 'assets', 'clientside.js'), f.name, str(repeat)])
+    return json.loads(output)
+
+
+def run(scale, directory, repeat):
+    """Every stage at one scale, in this process."""
+    snapshots = tempfile.mkdtemp(prefix='covid19-benchmark-')
+    os.environ.update({
+        'COVID19_FIXTURES_DIR': directory,
+        'COVID19_SNAPSHOT_DIR': snapshots,
+        'COVID19_SHARED_MEMORY': '0',
+        'COVID19_REFRESH_INTERVAL': '0',
+        'COVID19_PHASE_LOG': '0',
+    })
+    sys.path.insert(0, HERE)
+    import profiling
+
+    stages = []
+    try:
+        start = time.perf_counter()
+        app = __import__('app')
+        import_seconds = time.perf_counter() - start
+        # the data is loaded in the background after the import (see context.py)
+        start = time.perf_counter()
+        app.context.start()
+        app.context.wait()
+        load_seconds = time.perf_counter() - start
+        for record in profiling.report()['phases']:
+            record = collections.OrderedDict(
+                [('stage', 'startup')] + [(key, record[key]) for key in
+                                          ('phase', 'source', 'parent', 'seconds', 'rss_mb', 'rss_delta_mb')
+                                          if key in record])
+            stages.append(record)
+        stages.append(collections.OrderedDict(
+            [('stage', 'startup'), ('phase', 'import app'), ('seconds', round(import_seconds, 4))]))
+        stages.append(collections.OrderedDict(
+            [('stage', 'startup'), ('phase', 'load data'), ('seconds', round(load_seconds, 4))]))
+
+        import analytics
+        import dataset
+        import figures
+        import plotly.io as pio
+        data = dataset.current()
+
+        new_dates = _next_dates(data)
+        measure(stages, 'extend', lambda: dataset.extend(data, new_dates), repeat)
+        measure(stages, 'analytics', lambda: analytics.Analytics(
+            data.series, analytics.population(data)), repeat)
+
+        for name, (builder, sources, inputs) in figures.FIGURES.items():
+            fig = measure(stages, 'figure', lambda: builder(data), repeat, figure=name, step='build')
+            measure(stages, 'figure', lambda: pio.to_json(fig), repeat, figure=name, step='to_json')
+        for x_axis in figures.STATUS_AXES:
+            fig = measure(stages, 'figure', lambda: figures.status_figure(data, x_axis), repeat,
+                          figure='status', x_axis=x_axis, step='build')
+            measure(stages, 'figure', lambda: pio.to_json(fig), repeat,
+                    figure='status', x_axis=x_axis, step='to_json')
+
+        client = app.server.test_client()
+        measure(stages, 'layout', lambda: client.get('/_dash-layout').data, repeat)
+
+        for graph, (tabs, tab_value, name) in app.TAB_GRAPHS.items():
+            inputs = [{'id': tabs, 'property': 'value', 'value': tab_value}]
+            if graph in app.STATIC_GRAPHS:
+                # the interactive figure, as on a page without static images
+                inputs.append({'id': graph + '_hydrate', 'property': 'n_clicks', 'value': -1})
+            for step, runs in (('cold', 1), ('cached', repeat)):
+                measure(stages, 'callback', lambda: _post(client, graph + '.figure', inputs),
+                        runs, callback=graph, step=step)
+        days = data.series.days['confirmed']
+        for step, date_range in (('full', None), ('last 30 days', [int(days[-30]), int(days[-1])])):
+            inputs = [{'id': 'cases_tabs', 'property': 'value', 'value': 'time'},
+                      {'id': 'date_range', 'property': 'value', 'value': date_range},
+                      {'id': 'line_graph_hydrate', 'property': 'n_clicks', 'value': -1}]
+            measure(stages, 'callback', lambda: _post(client, 'line_graph.figure', inputs),
+                    repeat, callback='line_graph', step=step)
+        tree_days = data.hierarchy.days
+        for step, (case, kind, day) in (('latest', ('Confirmed', 'treemap', int(tree_days[-1]))),
+                                        ('deaths sunburst a month back',
+                                         ('Deaths', 'sunburst', int(tree_days[-30])))):
+            inputs = [{'id': 'cases_tabs', 'property': 'value', 'value': 'country'},
+                      {'id': 'tree_case', 'property': 'value', 'value': case},
+                      {'id': 'tree_kind', 'property': 'value', 'value': kind},
+                      {'id': 'tree_date', 'property': 'value', 'value': day},
+                      {'id': 'tree_graph_hydrate', 'property': 'n_clicks', 'value': -1}]
+            measure(stages, 'callback', lambda: _post(client, 'tree_graph.figure', inputs),
+                    repeat, callback='tree_graph', step=step)
+        measure(stages, 'callback', lambda: _post(
+            client, 'modal.is_open',
+            [{'id': 'open', 'property': 'n_clicks', 'value': 1},
+             {'id': 'close', 'property': 'n_clicks', 'value': None}],
+            [{'id': 'modal', 'property': 'is_open', 'value': False}]), repeat, callback='toggle_modal')
+
+        store = {x_axis: figures.status_figures.get(data, x_axis) for x_axis in figures.STATUS_AXES}
+        for record in _update_graph(store, repeat) or []:
+            stages.append(collections.OrderedDict(
+                [('stage', 'update_graph'), ('x_axis', record['x_axis']), ('y_axis', record['y_axis']),
+                 ('seconds', round(record['seconds'], 6)), ('runs', repeat)]))
+
+        shape = collections.OrderedDict([
+            ('regions', len(data.confirmed_df)),
+            ('dates', data.confirmed_df.shape[1] - 4),
+            ('full_table_rows', len(data.full_table)),
+            ('locations', len(data.demographic_df2)),
+        ])
+    finally:
+        shutil.rmtree(snapshots, ignore_errors=True)
+    return collections.OrderedDict([
+        ('scale', scale),
+        ('shape', shape),
+        ('peak_rss_mb', round(_peak_rss() / 2 ** 20, 1)),
+        ('stages', stages),
+    ])
+
+
+def _peak_rss():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline, figures and callbacks.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'covid19-benchmark'))
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run(args.child, fixtures(args.data_dir, args.child), args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    import dash
+    import plotly
+    results = collections.OrderedDict([
+        ('commit', _commit()),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S%z')),
+        ('python', platform.python_version()),
+        ('versions', {'pandas': pd.__version__, 'numpy': np.__version__,
+                      'plotly': plotly.__version__, 'dash': dash.__version__}),
+        ('repeat', args.repeat),
+        ('scales', []),
+    ])
+    for scale in args.scales:
+        fixtures(args.data_dir, scale)
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            # a fresh process per scale, so imports, caches and peak memory do not carry over
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', str(scale),
+                                   '--repeat', str(args.repeat), '--data-dir', args.data_dir,
+                                   '--output', f.name])
+            result = json.load(open(f.name))
+        results['scales'].append(result)
+        total = sum(record['seconds'] for record in result['stages']
+                    if record['stage'] == 'startup' and record.get('phase') == 'startup')
+        print("%dx: %s, startup %.2fs, peak %.0f MB" % (
+            scale, ', '.join('%s %d' % item for item in result['shape'].items()),
+            total, result['peak_rss_mb']), flush=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print("Results written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
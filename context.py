@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Lazily initialized data of the app.
+
+create_app (app.py) only builds the Dash app. start() loads the data in a
+background thread of the serving process, so the server answers health checks
+and a placeholder page while the first generation is built. The data modules
+(pandas, plotly.express...) are only imported by that thread or on first use
+through LazyModule. A failed load is retried, the server keeps running.
+"""
+
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import profiling
+
+# seconds between attempts to load the data
+LOAD_RETRY = float(os.environ.get('COVID19_LOAD_RETRY', 30))
+
+# modules the fork server imports once, those the parse and figure pools run
+FORKSERVER_PRELOAD = ['datastore', 'figures']
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_state = {'pid': None, 'started_at': None, 'error': None}
+
+
+class LazyModule(object):
+    """Module imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+
+def _load():
+    while True:
+        try:
+            import refresh
+            refresh.load()
+            # the refresh thread and the static images, per process
+            refresh.start()
+            _state['error'] = None
+            _ready.set()
+            return
+        except Exception as error:
+            _state['error'] = repr(error)
+            profiling.log('load_failed', 'error', retry_in=LOAD_RETRY)
+            time.sleep(LOAD_RETRY)
+
+
+def start():
+    """Load the data in a background thread, once per process (forked workers start again)."""
+    if _state['pid'] == os.getpid():
+        return
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+        _state['started_at'] = time.time()
+        threading.Thread(target=_load, name='covid19-load', daemon=True).start()
+
+
+def ready():
+    return _ready.is_set()
+
+
+def wait(timeout=None):
+    """Block until the data is loaded, True when it is."""
+    return _ready.wait(timeout)
+
+
+def version():
+    """Version of the generation served, -1 while loading."""
+    if not ready():
+        return -1
+    import dataset
+    return dataset.current().version
+
+
+def forkserver():
+    """
+    multiprocessing context of the parse pool (datastore.py) and the figure
+    pool (figures.py). The data is loaded and refreshed in background threads,
+    forking those is not safe. The one fork server of the process starts clean,
+    with the modules of both pools imported.
+    """
+    forkserver_context = multiprocessing.get_context('forkserver')
+    forkserver_context.set_forkserver_preload(FORKSERVER_PRELOAD)
+    return forkserver_context
+
+
+def status():
+    started_at = _state['started_at']
+    return OrderedDict([
+        ('ready', ready()),
+        ('version', version() if ready() else None),
+        ('loading_seconds', round(time.time() - started_at, 3) if started_at and not ready() else None),
+        ('error', _state['error']),
+    ])
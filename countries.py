@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Per-country index of a data generation.
+
+The index is built once per generation, on first use, from the dense JHU
+series (timeseries.TimeSeries) and the latest full_table rows. Looking up a
+country then only slices its own row of the country rollups and its own run
+of provinces, it never filters the frames.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import dataset
+import timerange
+
+_lock = threading.Lock()
+
+
+def _floats(values):
+    # NaN (no cases yet) as JSON null
+    return [None if value != value else value for value in np.round(values, 3).tolist()]
+
+
+class CountryIndex(object):
+    """Country series, daily changes, rolling statistics, rates and provinces, by country name."""
+
+    def __init__(self, data):
+        series = data.series
+        self.series = series
+        self.analytics = data.analytics
+        present = np.flatnonzero(series.regions)
+        self.codes = OrderedDict((series.countries[code], code) for code in present)
+        # the files can briefly differ by a date while a refresh appends to them
+        self.length = min(len(series.dates[name]) for name in dataset.JHU_SOURCES)
+        # ISO dates, like /api/range and /api/v1
+        self.dates = timerange.iso(series.days['confirmed'][:self.length])
+
+        # provinces grouped by country, largest first, from the latest full_table rows
+        latest = data.full_latest
+        order = np.lexsort((-latest['Confirmed'].to_numpy(),
+                            latest['Country/Region'].to_numpy(dtype=str)))
+        self.provinces = {column.lower(): latest[column].to_numpy()[order] for column in dataset.cases}
+        self.provinces['province'] = latest['Province/State'].to_numpy(dtype=object)[order]
+        names = latest['Country/Region'].to_numpy(dtype=object)[order]
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if len(names) else np.array([], int)
+        stops = np.r_[starts[1:], len(names)]
+        self.province_runs = {names[start]: (start, stop) for start, stop in zip(starts, stops)}
+
+        latest_confirmed = series.country['confirmed'][present, self.length - 1] if self.length else []
+        self.largest = series.countries[present[np.argmax(latest_confirmed)]] if len(present) else None
+
+    @property
+    def names(self):
+        return list(self.codes)
+
+    def __contains__(self, country):
+        return country in self.codes
+
+    def _statistic(self, code, name, stat):
+        # one precomputed row of analytics.Analytics
+        return _floats(self.analytics.country[name][stat][code, :self.length])
+
+    def lookup(self, country):
+        """Everything known about country, None when there is no such country."""
+        code = self.codes.get(country)
+        if code is None:
+            return None
+        values = OrderedDict((name, self.series.country[name][code, :self.length])
+                             for name in ('confirmed', 'deaths', 'recovered'))
+        values['active'] = values['confirmed'] - values['deaths'] - values['recovered']
+
+        confirmed = values['confirmed'].astype(float)
+        confirmed[confirmed == 0] = np.nan
+        start, stop = self.province_runs.get(country, (0, 0))
+        return OrderedDict([
+            ('country', country),
+            ('dates', self.dates),
+            ('series', OrderedDict((name, series.tolist()) for name, series in values.items())),
+            ('daily', OrderedDict((name, np.diff(series, prepend=0).tolist())
+                                  for name, series in values.items())),
+            ('mean7', OrderedDict((name, self._statistic(code, name, 'mean7'))
+                                  for name in dataset.JHU_SOURCES)),
+            ('growth', self._statistic(code, 'confirmed', 'growth')),
+            ('doubling', self._statistic(code, 'confirmed', 'doubling')),
+            ('per_million', OrderedDict((name, self._statistic(code, name, 'per_million'))
+                                        for name in dataset.JHU_SOURCES)),
+            ('rates', OrderedDict([
+                ('recovery', _floats(values['recovered'] / confirmed * 100)),
+                ('mortality', _floats(values['deaths'] / confirmed * 100)),
+            ])),
+            ('provinces', [OrderedDict([
+                ('province', self.provinces['province'][i]),
+                ('confirmed', self.provinces['confirmed'][i].item()),
+                ('deaths', self.provinces['deaths'][i].item()),
+                ('recovered', self.provinces['recovered'][i].item()),
+                ('active', self.provinces['active'][i].item()),
+            ]) for i in range(start, stop)]),
+        ])
+
+
+def index(data):
+    """The CountryIndex of a generation, built on first use."""
+    country_index = data.country_index
+    if country_index is None:
+        with _lock:
+            country_index = data.country_index
+            if country_index is None:
+                country_index = data.country_index = CountryIndex(data)
+    return country_index
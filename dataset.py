@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Derived data for the dashboard.
+
+A Dataset is one generation of every frame, series, scalar and figure the app
+serves. Generations are never modified after they are published: a refresh
+builds a new one (reusing whatever did not change) and swaps it in with a
+single reference assignment, so a request that grabbed current() keeps a
+consistent view for its whole duration.
+"""
+
+import copy
+import threading
+
+import pandas as pd
+
+import analytics
+import datastore
+import hierarchy
+import profiling
+import timeseries
+
+# the JHU wide-format files, they only grow to the right by one date column a day
+JHU_SOURCES = ('confirmed', 'deaths', 'recovered')
+JHU_FRAMES = {'confirmed': 'confirmed_df',
+              'deaths': 'death_df', 'recovered': 'recovered_df'}
+
+# the cleaned frames every other frame is derived from
+FRAMES = ('full_table', 'confirmed_df', 'death_df',
+          'recovered_df', 'demographic_df2')
+
+# the columns up to four are non-date columns
+ID_COLUMNS = ['Province/State', 'Country/Region', 'Lat', 'Long']
+
+# cases
+cases = ['Confirmed', 'Deaths', 'Recovered', 'Active']
+
+# Since there are a lot of countries, for easy visualization let us only look at countries with high numbers
+MIN_CASES = 10000
+
+
+class Dataset(object):
+    """One immutable generation of the dashboard data."""
+
+    def __init__(self):
+        self.version = 0
+        self.digests = {}
+        # source name -> version of the generation it last changed in
+        self.changed_at = {}
+        # countries.CountryIndex, built on first use
+        self.country_index = None
+        # analytics.Analytics of the JHU series
+        self.analytics = None
+
+    def derive(self):
+        """Shallow copy to build the next generation from."""
+        data = copy.copy(self)
+        data.version = self.version + 1
+        data.digests = dict(self.digests)
+        data.changed_at = dict(self.changed_at)
+        data.country_index = None
+        return data
+
+
+# ---------------------------------------------------------------------------------------------
+# Collecting and cleaning data
+
+def clean_full_table(data, full_table):
+    with profiling.phase('clean', 'full_table'):
+        # Active Case = confirmed - deaths - recovered
+        full_table['Active'] = full_table['Confirmed'] - \
+            full_table['Deaths'] - full_table['Recovered']
+
+        # replacing Mainland china with just China
+        full_table['Country/Region'] = full_table['Country/Region'].replace(
+            'Mainland China', 'China')
+
+        # filling missing values
+        full_table[['Province/State']] = full_table[['Province/State']].fillna('')
+        full_table[cases] = full_table[cases].fillna(0)
+
+    data.full_table = full_table
+    derive_full_table(data)
+
+
+@profiling.phase('aggregate', 'full_table')
+def derive_full_table(data):
+    full_table = data.full_table
+
+    # latest
+    full_latest = full_table[full_table['Date']
+                             == max(full_table['Date'])].reset_index()
+
+    # latest condensed
+    full_latest_grouped = full_latest.groupby(
+        'Country/Region')['Confirmed', 'Deaths', 'Recovered', 'Active'].sum().reset_index()
+
+    # one groupby for the cumulative and the day over day views of the status graph, a
+    # column per case indexed by date
+    status_totals = full_table.groupby('Date')[['Recovered', 'Deaths', 'Active']].sum()
+
+    full_latest["world"] = "world"
+
+    # the treemap's rollup, every case and date
+    data.hierarchy = hierarchy.Hierarchy(full_table, cases)
+
+    data.full_latest = full_latest
+    data.full_latest_grouped = full_latest_grouped
+    data.status_totals = status_totals
+
+
+def clean_jhu(df):
+    # Rename to consistent values
+    df['Country/Region'].replace('Mainland China', 'China', inplace=True)
+
+    # rename
+    df = df.rename(columns={'Country/Region': 'country'})
+
+    # Handle empty data
+    df[['Province/State']] = df[['Province/State']].fillna('')
+    df.fillna(0, inplace=True)
+    return df
+
+
+def clean_demographic(data, demographic_df):
+    # the census figures only need the latest values of every location, the OWID
+    # aggregates (World, continents...) have no continent. datastore already reduces
+    # the file to that while reading it, this also covers frames parsed whole
+    with profiling.phase('clean', 'demographic'):
+        not_na = demographic_df["continent"].notna()
+        data.demographic_df2 = demographic_df[not_na].groupby(
+            'location', observed=True, sort=False).last().reset_index()
+    derive_demographic(data)
+    if data.analytics is not None:
+        # new populations, the per-capita rates change
+        data.analytics = data.analytics.with_population(data.series, analytics.population(data))
+
+
+@profiling.phase('aggregate', 'demographic')
+def derive_demographic(data):
+    data.demographic_df3 = data.demographic_df2.dropna(
+        subset=['total_deaths_per_million'])
+
+
+# ---------------------------------------------------------------------------------------------
+# Aggregating
+
+def aggregate_world(data, worldwide_confirmed, worldwide_deaths, worldwide_recovered):
+    # Aggregating all the data to see a snapshot of the total number of cases
+    total_confirmed = worldwide_confirmed.max()
+    total_deaths = worldwide_deaths.max()
+    total_recovered = worldwide_recovered.max()
+    total_active = total_confirmed - (total_deaths + total_recovered)
+
+    # the total number of active cases is: Active = confimred - deaths - recovered
+    world_df = pd.DataFrame({
+        'confirmed': [total_confirmed],
+        'deaths': [total_deaths],
+        'recovered': [total_recovered],
+        'active': [total_confirmed - total_deaths - total_recovered]
+    })
+
+    # unpivot the dataframe from wide to long format
+    word_long_df = world_df.melt(
+        value_vars=['active', 'deaths', 'recovered'], var_name="status", value_name="count")
+    word_long_df['upper'] = 'confirmed'
+
+    # time series, deaths enter the rates as the latest total rather than per date
+    worldwide_active = worldwide_confirmed - total_deaths - worldwide_recovered
+
+    # calculate recovery and mortality rates as a fraction of confirmed
+    world_rate_df = pd.DataFrame({
+        'confirmed': worldwide_confirmed,
+        'deaths': total_deaths,
+        'recovered': worldwide_recovered,
+        'active': worldwide_active
+    }, index=worldwide_confirmed.index)
+
+    world_rate_df['recovery rate'] = world_rate_df['recovered'] / \
+        world_rate_df['confirmed'] * 100
+    world_rate_df['mortality rate'] = world_rate_df['deaths'] / \
+        world_rate_df['confirmed'] * 100
+    world_rate_df['date'] = world_rate_df.index
+
+    # unpivot the dataframe from wide to long format
+    word_rate_long_df = world_rate_df.melt(id_vars='date',
+                                           value_vars=['recovery rate', 'mortality rate'], var_name="status", value_name="ratio")
+
+    data.total_confirmed = total_confirmed
+    data.total_deaths = total_deaths
+    data.total_recovered = total_recovered
+    data.total_active = total_active
+    data.world_df = world_df
+    data.word_long_df = word_long_df
+    data.worldwide_confirmed = worldwide_confirmed
+    data.worldwide_deaths = worldwide_deaths
+    data.worldwide_recovered = worldwide_recovered
+    data.worldwide_active = worldwide_active
+    data.world_rate_df = world_rate_df
+    data.word_rate_long_df = word_rate_long_df
+
+
+def aggregate_countries(data):
+    # per-country table from the dense series rollup
+    covid_confirmed_agg_all = data.series.country_frame('confirmed')
+    covid_confirmed_agg = covid_confirmed_agg_all[covid_confirmed_agg_all.iloc[:, 3:].max(
+        axis=1) > MIN_CASES]
+
+    data.covid_confirmed_agg = covid_confirmed_agg
+
+
+@profiling.phase('aggregate', 'jhu')
+def derive_jhu(data):
+    data.series = timeseries.TimeSeries(
+        {name: getattr(data, attribute) for name, attribute in JHU_FRAMES.items()})
+    data.analytics = analytics.Analytics(data.series, analytics.population(data))
+    derive_series(data)
+
+
+def derive_series(data):
+    series = data.series
+    aggregate_world(data, series.world_series('confirmed'),
+                    series.world_series('deaths'), series.world_series('recovered'))
+    aggregate_countries(data)
+
+    # past 24 hours increases of the header cards, active as confirmed minus recovered
+    # like worldwide_active (deaths enter as the latest total)
+    data.new_confirmed = int(data.analytics.latest('confirmed', 'daily'))
+    data.new_active = data.new_confirmed - int(data.analytics.latest('recovered', 'daily'))
+
+
+# ---------------------------------------------------------------------------------------------
+# Building generations
+
+def build(frames, digests=None, version=0):
+    """Full build of a generation from the raw source frames."""
+    data = Dataset()
+    data.version = version
+    data.digests = dict(digests or {})
+    data.changed_at = dict.fromkeys(frames, version)
+
+    clean_full_table(data, frames['full_table'])
+    clean_demographic(data, frames['demographic'])
+
+    with profiling.phase('clean', 'jhu'):
+        data.confirmed_df = clean_jhu(frames['confirmed'])
+        data.death_df = clean_jhu(frames['deaths'])
+        data.recovered_df = clean_jhu(frames['recovered'])
+
+    derive_jhu(data)
+    return data
+
+
+def derive_all(data):
+    """Everything derived from the cleaned frames, which are only read."""
+    derive_full_table(data)
+    derive_demographic(data)
+    derive_jhu(data)
+    return data
+
+
+def extend(data, new_dates):
+    """
+    Next generation with newly appended JHU date columns.
+
+    new_dates maps a JHU source to a frame holding only its new date columns
+    (rows in the same order as the current frame). Only the new columns are
+    reduced, the dense series are extended rather than rebuilt.
+    """
+    data = data.derive()
+    new_dates = {name: dates.fillna(0) for name, dates in new_dates.items()}
+    for name, dates in new_dates.items():
+        attribute = JHU_FRAMES[name]
+        setattr(data, attribute, pd.concat([getattr(data, attribute), dates], axis=1))
+    with profiling.phase('aggregate', 'jhu'):
+        data.series = data.series.append(new_dates)
+        if data.series.revised:
+            # validation corrected earlier dates, the rolling statistics are computed again
+            data.analytics = analytics.Analytics(data.series, data.analytics.population)
+        else:
+            data.analytics = data.analytics.append(data.series)
+        derive_series(data)
+    return data
+
+
+# ---------------------------------------------------------------------------------------------
+# Publishing
+
+_current = None
+_lock = threading.Lock()
+
+
+def current():
+    """The generation requests should read from."""
+    return _current
+
+
+def publish(data):
+    global _current
+    with _lock:
+        _current = data
+    return data
+
+
+def load():
+    """Build the first generation from the snapshot store."""
+    frames = datastore.load_all()
+    digests = {name: datastore.read_manifest(name)['sha1'] for name in frames}
+    return build(frames, digests)
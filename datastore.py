@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Local snapshot store for the upstream CSV sources.
+
+Every source is saved as a typed columnar snapshot on disk: one .npy file per
+column plus a manifest.json with the dtypes, the sha1 of the upstream bytes and
+a version number. The app loads from the snapshot at startup and only re-parses
+the CSV when the upstream content actually changed.
+
+Stale sources are downloaded concurrently with conditional requests (ETag /
+If-Modified-Since), streamed to a local file and parsed in a process pool as
+their downloads complete. Sources with a 'reduce' entry are parsed in chunks
+and only their per-key reduction is kept, so memory stays bounded however
+large the file grows.
+
+Environment:
+    COVID19_SNAPSHOT_DIR      where snapshots are kept (default ./snapshots)
+    COVID19_SNAPSHOT_MAX_AGE  seconds a snapshot is trusted without checking
+                              upstream (default 6 hours)
+    COVID19_FIXTURES_DIR      read the CSVs from this directory instead of the
+                              network, so the app can boot offline
+    COVID19_SOURCE_URL        fetch every source from this base URL instead
+                              (a mirror or a local stand-in server)
+    COVID19_PARSE_PROCESSES   processes parsing downloads (0 parses in-process)
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import context
+import profiling
+
+# ---------------------------------------------------------------------------------------------
+# sources
+
+JHU_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/"
+
+SOURCES = {
+    'deaths': {
+        'url': JHU_URL + "time_series_covid19_deaths_global.csv",
+        'file': "time_series_covid19_deaths_global.csv",
+    },
+    'confirmed': {
+        'url': JHU_URL + "time_series_covid19_confirmed_global.csv",
+        'file': "time_series_covid19_confirmed_global.csv",
+    },
+    'recovered': {
+        'url': JHU_URL + "time_series_covid19_recovered_global.csv",
+        'file': "time_series_covid19_recovered_global.csv",
+    },
+    'full_table': {
+        'url': "https://raw.githubusercontent.com/imdevskp/covid_19_jhu_data_web_scrap_and_cleaning/master/covid_19_clean_complete.csv",
+        'file': "covid_19_clean_complete.csv",
+        'read_csv': {'parse_dates': ['Date']},
+    },
+    'demographic': {
+        'url': "https://covid.ourworldindata.org/data/owid-covid-data.csv",
+        'file': "owid-covid-data.csv",
+        # the census figures only use the latest values of every location with a continent,
+        # the file is read in chunks keeping just that (see parse)
+        'reduce': {'key': 'location', 'required': 'continent'},
+        # only the columns the census figures use, most of the file is never read
+        'read_csv': {
+            'usecols': ['continent', 'location', 'gdp_per_capita', 'hospital_beds_per_thousand',
+                        'handwashing_facilities', 'life_expectancy', 'total_deaths_per_million',
+                        'population'],
+            'dtype': {
+                'continent': 'category',
+                'location': 'category',
+                'gdp_per_capita': 'float32',
+                'hospital_beds_per_thousand': 'float32',
+                'handwashing_facilities': 'float32',
+                'life_expectancy': 'float32',
+                'total_deaths_per_million': 'float32',
+                'population': 'float64',
+            },
+        },
+    },
+}
+
+# bump when the on-disk layout changes, older snapshots are then ignored
+SNAPSHOT_FORMAT = 1
+
+SNAPSHOT_DIR = os.environ.get(
+    'COVID19_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+SNAPSHOT_MAX_AGE = float(os.environ.get('COVID19_SNAPSHOT_MAX_AGE', 6 * 60 * 60))
+FIXTURES_DIR = os.environ.get('COVID19_FIXTURES_DIR')
+SOURCE_URL = os.environ.get('COVID19_SOURCE_URL')
+PARSE_PROCESSES = int(os.environ.get(
+    'COVID19_PARSE_PROCESSES', min(len(SOURCES), os.cpu_count() or 1)))
+
+FETCH_TIMEOUT = 60
+
+# download buffer, and rows per chunk of the sources parsed in chunks
+COPY_BUFFER = 1 << 20
+CHUNK_ROWS = 100000
+
+
+# ---------------------------------------------------------------------------------------------
+# fetching
+
+def source_url(name):
+    if SOURCE_URL:
+        return SOURCE_URL.rstrip('/') + '/' + SOURCES[name]['file']
+    return SOURCES[name]['url']
+
+
+# a source on local disk, the file is removed by discard unless it is a fixture
+Download = collections.namedtuple('Download', 'path sha1 validators')
+
+
+def _copy(source, target):
+    """Copy a stream in chunks, returns the sha1 of what was copied."""
+    sha1 = hashlib.sha1()
+    while True:
+        chunk = source.read(COPY_BUFFER)
+        if not chunk:
+            return sha1.hexdigest()
+        sha1.update(chunk)
+        if target is not None:
+            target.write(chunk)
+
+
+def download(name, manifest=None):
+    """
+    Download of a source, or None when upstream answers that it did not change
+    since the snapshot of manifest (HTTP 304).
+
+    The body is streamed to a file next to the snapshots (gzip responses are
+    decoded on the way) and hashed as it goes, it is never held in memory.
+    validators holds the ETag and Last-Modified headers sent back with the
+    next conditional request.
+    """
+    source = SOURCES[name]
+    if FIXTURES_DIR:
+        path = os.path.join(FIXTURES_DIR, source['file'])
+        with open(path, 'rb') as f:
+            return Download(path, _copy(f, None), {})
+
+    request = urllib.request.Request(source_url(name), headers={'Accept-Encoding': 'gzip'})
+    if manifest and manifest.get('etag'):
+        request.add_header('If-None-Match', manifest['etag'])
+    if manifest and manifest.get('last_modified'):
+        request.add_header('If-Modified-Since', manifest['last_modified'])
+
+    os.makedirs(_source_dir(name), exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='download-', suffix='.csv', dir=_source_dir(name))
+    try:
+        with open(fd, 'wb') as f, urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            body = response
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=response)
+            sha1 = _copy(body, f)
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+    except BaseException as error:
+        os.remove(path)
+        if isinstance(error, urllib.error.HTTPError) and error.code == 304:
+            return None
+        raise
+    return Download(path, sha1, {key: value for key, value in validators.items() if value})
+
+
+def discard(download):
+    """Remove the downloaded file once it is parsed."""
+    if download is not None and not (FIXTURES_DIR and download.path.startswith(FIXTURES_DIR)):
+        try:
+            os.remove(download.path)
+        except OSError:
+            pass
+
+
+def _download(name, manifest):
+    with profiling.phase('download', name):
+        return download(name, manifest)
+
+
+def download_all(names, manifests=None):
+    """
+    Download names concurrently, yields (name, download result, error) as
+    each one completes. error is the OSError of a failed download.
+    """
+    manifests = manifests or {}
+    with concurrent.futures.ThreadPoolExecutor(max(len(names), 1), 'covid19-download') as pool:
+        futures = {pool.submit(_download, name, manifests.get(name)): name for name in names}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except OSError as error:
+                yield futures[future], None, error
+
+
+def parse(name, path):
+    """DataFrame of a downloaded source (a path or a binary file object)."""
+    source = SOURCES[name]
+    if 'reduce' in source:
+        return _parse_reduced(path, source)
+    return pd.read_csv(path, **source.get('read_csv', {}))
+
+
+def _parse_reduced(path, source):
+    """
+    Last non-null value of every column per key, over the rows that have the
+    required column, read CHUNK_ROWS rows at a time.
+    """
+    key = source['reduce']['key']
+    required = source['reduce']['required']
+    options = dict(source.get('read_csv', {}))
+    # categoricals are slow to group chunk by chunk, their categories differ between
+    # chunks anyway, so they are read as strings and the declared dtypes restored at the end
+    dtypes = options.pop('dtype', {})
+    options['dtype'] = {column: object if dtype == 'category' else dtype
+                        for column, dtype in dtypes.items()}
+    columns = None
+    reduced = None
+    for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS, **options):
+        columns = chunk.columns
+        latest = chunk[chunk[required].notna()].groupby(key, sort=False).last()
+        if reduced is not None:
+            # keys in order of first appearance, later chunks win where not null
+            latest = pd.concat([reduced, latest]).groupby(level=0, sort=False).last()
+        reduced = latest
+    if reduced is None:
+        return pd.read_csv(path, nrows=0, **source.get('read_csv', {}))
+    df = reduced.reset_index()[columns]
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df})
+
+
+def _parse_timed(name, path):
+    start = time.perf_counter()
+    df = parse(name, path)
+    return df, time.perf_counter() - start
+
+
+class _InlineExecutor(object):
+    """Executor running every call right away in the caller's thread."""
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def _parse_pool(jobs):
+    """Process pool for parsing jobs downloads, inline when that does not pay off."""
+    processes = min(PARSE_PROCESSES, jobs)
+    if processes < 2:
+        return _InlineExecutor()
+    # from the fork server (see context.forkserver), the pool is shut down once the
+    # downloads are parsed
+    pool = concurrent.futures.ProcessPoolExecutor(processes, context.forkserver())
+    # start the workers now, they start up while the sources download
+    pool.submit(int).result()
+    return pool
+
+
+# ---------------------------------------------------------------------------------------------
+# snapshots
+
+def _source_dir(name):
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def _schema(name):
+    source = SOURCES[name]
+    return json.dumps([source.get('read_csv', {}), source.get('reduce')], sort_keys=True)
+
+
+def read_manifest(name):
+    try:
+        with open(os.path.join(_source_dir(name), 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # snapshots parsed with another layout or read_csv schema are stale
+    if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('schema') != _schema(name):
+        return None
+    return manifest
+
+
+def _write_json(path, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+@contextlib.contextmanager
+def _locked(name):
+    """Serialize snapshot writers across threads and gunicorn workers."""
+    os.makedirs(_source_dir(name), exist_ok=True)
+    with open(os.path.join(_source_dir(name), '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _save_column(version_dir, entry, series):
+    if series.dtype == object or pd.api.types.is_categorical_dtype(series.dtype):
+        # strings are stored as int32 codes into a category list, -1 is NaN
+        categorical = pd.Categorical(series)
+        entry['kind'] = 'object' if series.dtype == object else 'category'
+        entry['categories'] = [str(c) for c in categorical.categories]
+        values = categorical.codes.astype(np.int32)
+    else:
+        entry['kind'] = 'array'
+        values = series.to_numpy()
+    np.save(os.path.join(version_dir, entry['file']), values, allow_pickle=False)
+    return entry
+
+
+def _new_version(name, previous):
+    version = previous['version'] + 1 if previous else 1
+    version_dir = os.path.join(_source_dir(name), 'v%d' % version)
+    if os.path.isdir(version_dir):
+        shutil.rmtree(version_dir)
+    os.makedirs(version_dir)
+    return version, version_dir
+
+
+def _publish_version(name, previous, version, sha1, rows, columns, validators):
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'schema': _schema(name),
+        'version': version,
+        'sha1': sha1,
+        'saved_at': time.time(),
+        'rows': rows,
+        'columns': columns,
+    }
+    manifest.update(validators or {})
+    _write_json(os.path.join(_source_dir(name), 'manifest.json'), manifest)
+
+    # keep the previous version around for readers that still have it open
+    if previous and previous['version'] > 1:
+        shutil.rmtree(os.path.join(_source_dir(name), 'v%d' %
+                                   (previous['version'] - 1)), ignore_errors=True)
+    return version
+
+
+def save_snapshot(name, df, sha1, validators=None):
+    """Write df as a new snapshot version and point the manifest at it."""
+    with _locked(name):
+        previous = read_manifest(name)
+        version, version_dir = _new_version(name, previous)
+        columns = [_save_column(version_dir, {'name': column, 'file': 'c%04d.npy' % i}, series)
+                   for i, (column, series) in enumerate(df.items())]
+        return _publish_version(name, previous, version, sha1, len(df), columns, validators)
+
+
+def append_snapshot(name, df, sha1, validators=None):
+    """
+    New snapshot version with the columns of df appended to the current one.
+
+    Existing column files are hard-linked into the new version, only the new
+    columns are written.
+    """
+    with _locked(name):
+        previous = read_manifest(name)
+        if previous is None or previous['rows'] != len(df):
+            raise ValueError("Cannot append %d rows to snapshot %s" % (len(df), name))
+        version, version_dir = _new_version(name, previous)
+        previous_dir = os.path.join(_source_dir(name), 'v%d' % previous['version'])
+        columns = []
+        for entry in previous['columns']:
+            source = os.path.join(previous_dir, entry['file'])
+            target = os.path.join(version_dir, entry['file'])
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copyfile(source, target)
+            columns.append(entry)
+        for i, (column, series) in enumerate(df.items(), len(columns)):
+            columns.append(_save_column(
+                version_dir, {'name': column, 'file': 'c%04d.npy' % i}, series))
+        return _publish_version(name, previous, version, sha1, len(df), columns, validators)
+
+
+def load_snapshot(name, manifest=None, mmap_mode=None):
+    manifest = manifest or read_manifest(name)
+    if manifest is None:
+        return None
+    version_dir = os.path.join(_source_dir(name), 'v%d' % manifest['version'])
+    data = {}
+    for entry in manifest['columns']:
+        values = np.load(os.path.join(version_dir, entry['file']),
+                         mmap_mode=mmap_mode, allow_pickle=False)
+        if entry['kind'] in ('object', 'category'):
+            values = pd.Categorical.from_codes(values, entry['categories'])
+            if entry['kind'] == 'object':
+                values = values.astype(object)
+        data[entry['name']] = values
+    return pd.DataFrame(data, columns=[entry['name'] for entry in manifest['columns']])
+
+
+# ---------------------------------------------------------------------------------------------
+# loading
+
+def _read_snapshot(name, manifest):
+    with profiling.phase('read_snapshot', name):
+        return load_snapshot(name, manifest)
+
+
+def _touch(name, manifest, validators=None):
+    # unchanged upstream, just mark the snapshot as fresh again
+    with _locked(name):
+        manifest['saved_at'] = time.time()
+        manifest.update(validators or {})
+        _write_json(os.path.join(_source_dir(name), 'manifest.json'), manifest)
+
+
+def load_all(max_age=None, names=None):
+    """
+    DataFrames for the sources (all of them by default).
+
+    A snapshot younger than max_age is used without touching upstream. The other
+    sources are downloaded concurrently and each one is parsed in the process
+    pool as soon as its download completes, while the rest still download. A
+    source is only parsed when upstream sent new content (no 304 and another
+    sha1 than its snapshot), and if its download or parse fails the last good
+    snapshot is used.
+    """
+    max_age = SNAPSHOT_MAX_AGE if max_age is None else max_age
+    names = list(SOURCES) if names is None else list(names)
+    manifests = {name: read_manifest(name) for name in names}
+    frames = {}
+    stale = []
+    for name in names:
+        manifest = manifests[name]
+        if manifest and time.time() - manifest['saved_at'] < max_age:
+            frames[name] = _read_snapshot(name, manifest)
+        else:
+            stale.append(name)
+
+    parsing = {}
+    with _parse_pool(len(stale)) as pool:
+        for name, fetched, error in download_all(stale, manifests):
+            manifest = manifests[name]
+            if error is not None:
+                if manifest is None:
+                    raise error
+                profiling.log('fetch_failed', 'warning', source=name, error=repr(error),
+                              fallback='snapshot v%d' % manifest['version'])
+                frames[name] = _read_snapshot(name, manifest)
+            elif fetched is None:
+                _touch(name, manifest)
+                frames[name] = _read_snapshot(name, manifest)
+            elif manifest and manifest['sha1'] == fetched.sha1:
+                discard(fetched)
+                _touch(name, manifest, fetched.validators)
+                frames[name] = _read_snapshot(name, manifest)
+            else:
+                parsing[name] = (pool.submit(_parse_timed, name, fetched.path), fetched)
+
+        for name, (future, fetched) in parsing.items():
+            manifest = manifests[name]
+            try:
+                frames[name], seconds = future.result()
+            except Exception as error:
+                # a broken upstream file (or pool), keep the last good snapshot
+                if manifest is None:
+                    raise
+                profiling.log('parse_failed', 'warning', source=name, error=repr(error),
+                              fallback='snapshot v%d' % manifest['version'])
+                frames[name] = _read_snapshot(name, manifest)
+                continue
+            finally:
+                discard(fetched)
+            profiling.add_phase('parse', seconds, name)
+            with profiling.phase('save_snapshot', name):
+                save_snapshot(name, frames[name], fetched.sha1, fetched.validators)
+    return {name: frames[name] for name in names}
+
+
+# ---------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # refresh every snapshot, e.g. from a release phase or cron job
+    load_all(max_age=0)
+    for source in SOURCES:
+        print(source, 'v%d' % read_manifest(source)['version'])
@@ -0,0 +1,577 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Plotly figures for the dashboard.
+
+Each figure is built from a Dataset generation. FIGURES records which sources
+a figure is derived from, so a refresh only rebuilds the figures whose inputs
+changed, and which Dataset attributes its builder reads. The figures are kept
+serialized in a FigureCache. build_figures builds them as independent jobs in
+a long-lived process pool, one process per core, each process is only sent
+the attributes its figure reads and returns the figure's JSON, so a build
+scales with the cores rather than with the number of figures. With one core
+(or COVID19_FIGURE_PROCESSES=0) they are built in-process, the tab figures on
+first use. With shared memory (arena.py) the worker sharing a generation saves
+the figures it built next to it and the other workers load them instead of
+building them again, so only that worker starts a pool.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import context
+import profiling
+import timerange
+import timeseries
+
+# Overwrite your CSS setting by including style locally
+colors = {
+    'background': '#2D2D2D',
+    'text': '#E1E2E5',
+    'figure_text': '#ffffff',
+    'confirmed_text': '#3CA4FF',
+    'deaths_text': '#f44336',
+    'recovered_text': '#5A9E6F',
+    'highest_case_bg': '#393939',
+    'active_text': '#ffa500',
+}
+
+# map animation step: 'D' (daily), 'W' (weekly) or 'M' (monthly)
+MAP_FREQUENCY = os.environ.get('COVID19_MAP_FREQUENCY', 'W')
+
+# scatter rendering of the census figures: 'webgl' (Scattergl) or 'svg'
+RENDER_MODE = os.environ.get('COVID19_RENDER_MODE', 'webgl')
+
+# bars of the bar chart race
+RACE_TOP = int(os.environ.get('COVID19_RACE_TOP', 10))
+
+# processes building figures, one per core by default (below 2 builds them in-process)
+FIGURE_PROCESSES = int(os.environ.get(
+    'COVID19_FIGURE_PROCESSES', os.cpu_count() if (os.cpu_count() or 1) > 1 else 0))
+
+
+# ---------------------------------------------------------------------------------------------
+# Visualizations
+
+def share_frames(fig):
+    """
+    Animation frames reduced to the positions and marker sizes of their points.
+
+    Names, ids, colors and hover templates are the same in every frame, they stay
+    in fig.data and the frames only update what moves. WebGL traces are redrawn
+    by every frame.
+    """
+    for frame in fig.frames:
+        frame.data = [trace.__class__(x=trace.x, y=trace.y, marker={'size': trace.marker.size})
+                      for trace in frame.data]
+    if RENDER_MODE == 'webgl':
+        for control in list(fig.layout.sliders) + list(fig.layout.updatemenus):
+            for item in control.steps if 'steps' in control else control.buttons:
+                if item.method == 'animate' and len(item.args) > 1:
+                    options = item.args[1]
+                    item.args = (item.args[0], dict(options, frame=dict(options['frame'], redraw=True)))
+    return fig
+
+
+def map_frames(columns, frequency=MAP_FREQUENCY):
+    """Positions of the date columns animated on the map, the last date of every period."""
+    if frequency == 'D':
+        return np.arange(len(columns))
+    periods = pd.to_datetime(columns, format='%m/%d/%y').to_period(frequency)
+    last = np.flatnonzero(periods[1:] != periods[:-1])
+    return np.append(last, len(columns) - 1)
+
+
+def map_figure(data, frequency=MAP_FREQUENCY):
+    # World map, one marker per country. Positions, names and colors are sent once,
+    # the animation frames and the slider only carry the marker sizes of each date
+    agg = data.covid_confirmed_agg
+    dates = agg.columns[3:]
+    keep = map_frames(dates, frequency)
+    counts = agg.iloc[:, 3:].to_numpy()[:, keep].T.astype(np.int64).tolist()
+    dates = list(dates[keep])
+
+    palette = px.colors.qualitative.Plotly
+    fig_map = go.Figure(
+        data=[go.Scattergeo(
+            lat=agg['Lat'].round(4).tolist(), lon=agg['Long'].round(4).tolist(),
+            text=agg['country'].tolist(),
+            hovertemplate="<b>%{text}</b><br>confirmed cases: %{marker.size:,}<extra></extra>",
+            marker={
+                'size': counts[-1],
+                'sizemode': 'area',
+                # same scaling as px size_max=80
+                'sizeref': max(agg.iloc[:, 3:].to_numpy().max(), 1) / 80 ** 2,
+                'color': [palette[i % len(palette)] for i in range(len(agg))],
+            },
+        )],
+        frames=[go.Frame(name=date, data=[go.Scattergeo(marker={'size': sizes})], traces=[0])
+                for date, sizes in zip(dates, counts)],
+    )
+    fig_map.update_layout(
+        title="COVID-19 Worldwide Confirmed Cases Over Time",
+        geo={'projection_type': 'natural earth'},
+        sliders=[{
+            'active': len(dates) - 1,
+            'currentvalue': {'prefix': 'Date: '},
+            'pad': {'t': 10},
+            'steps': [{'label': date, 'method': 'animate',
+                       'args': [[date], {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': True}}]}
+                      for date in dates],
+        }],
+        updatemenus=[{
+            'type': 'buttons', 'showactive': False, 'x': 0, 'y': 0, 'xanchor': 'right',
+            'buttons': [{'label': 'Play', 'method': 'animate',
+                         'args': [None, {'fromcurrent': True, 'frame': {'duration': 300, 'redraw': True}}]}],
+        }],
+        margin={'t': 30, 'l': 0, 'r': 0, 'b': 0},
+        plot_bgcolor=colors['background'],
+        paper_bgcolor=colors['background'],
+        font_color=colors['text']
+    )
+    return fig_map
+
+
+def tree_figure(data, case='Confirmed', day=None, kind='treemap'):
+    # Tree map (or sunburst) of a case column at a date (a day number, the latest by default),
+    # cut from the province rollup (hierarchy.py) and built as a plain dict
+    tree = data.hierarchy
+    position = tree.position(day)
+    return {
+        'data': [tree.trace(case, position, kind)],
+        'layout': {
+            'title': {'text': 'Total Number of Cases: %s, %s' % (case, timerange.iso([tree.days[position]])[0])},
+            'treemapcolorway': px.colors.qualitative.Prism,
+            'sunburstcolorway': px.colors.qualitative.Prism,
+            'margin': {'t': 50, 'l': 0, 'r': 0, 'b': 0},
+            'plot_bgcolor': colors['background'],
+            'paper_bgcolor': colors['background'],
+            'font': {'color': colors['text']},
+        },
+    }
+
+
+def line_figure(data, start=None, end=None, points=None):
+    # Evolution of cases, one line per country over a date window (day numbers, see
+    # timerange.py), every line downsampled to about the width of the plot
+    agg = data.covid_confirmed_agg
+    dates, counts = timerange.downsample(
+        data.series.days['confirmed'], agg.iloc[:, 3:].to_numpy(), start, end,
+        points or timerange.MAX_POINTS)
+    palette = px.colors.qualitative.Plotly
+    trace_type = 'scattergl' if RENDER_MODE == 'webgl' else 'scatter'
+    return {
+        'data': [{'type': trace_type, 'mode': 'lines', 'name': country, 'legendgroup': country,
+                  'x': x, 'y': y, 'line': {'color': palette[i % len(palette)]},
+                  'hovertemplate': '<b>' + country + '</b><br>date=%{x}<br>date_confirmed_cases=%{y}<extra></extra>'}
+                 for i, (country, x, y) in enumerate(zip(agg['country'], dates, counts))],
+        'layout': {
+            'title': {'text': 'Evolution of Cases Over Time'},
+            'xaxis': {'type': 'date', 'title': {'text': 'date'}},
+            'yaxis': {'title': {'text': 'date_confirmed_cases'}},
+            'legend': {'title': {'text': 'country'}, 'tracegroupgap': 0},
+            'margin': {'l': 0, 'r': 0, 'b': 0},
+            'plot_bgcolor': colors['background'],
+            'paper_bgcolor': colors['background'],
+            'font': {'color': colors['text']},
+        },
+    }
+
+
+def race_figure(data, top=RACE_TOP):
+    # Bar chart race of the confirmed cases. The top countries of every date are ranked at
+    # once over the (country x date) matrix, a frame only carries its bars: counts, names
+    # and palette positions (the colorscale steps through the palette), largest on top
+    series = data.series
+    present = np.flatnonzero(series.regions)
+    counts = series.country['confirmed'][present]
+    ranks = timeseries.top(counts, top)[::-1]
+    counts = np.take_along_axis(counts, ranks, axis=0).T.tolist()
+    names = series.countries[present].to_numpy(dtype=object)[ranks].T.tolist()
+    palette = px.colors.qualitative.Plotly
+    shades = (ranks % len(palette)).T.tolist()
+    dates = timerange.iso(series.days['confirmed'][:len(counts)])
+
+    def bars(position):
+        return {'x': counts[position], 'y': names[position], 'marker': {'color': shades[position]}}
+
+    last = len(dates) - 1
+    trace = bars(last)
+    trace['marker'].update(colorscale=[[i / (len(palette) - 1), color] for i, color in enumerate(palette)],
+                           cmin=0, cmax=len(palette) - 1)
+    trace.update(type='bar', orientation='h', texttemplate='%{x:,}', textposition='auto',
+                 hovertemplate='<b>%{y}</b><br>confirmed cases: %{x:,}<extra></extra>')
+    return {
+        'data': [trace],
+        'frames': [{'name': date, 'data': [bars(position)]} for position, date in enumerate(dates)],
+        'layout': {
+            'title': {'text': 'Confirmed Cases: Top %d Countries' % top},
+            'xaxis': {'autorange': True},
+            'yaxis': {'type': 'category', 'automargin': True},
+            'sliders': [{
+                'active': last,
+                'currentvalue': {'prefix': 'Date: '},
+                'pad': {'t': 30},
+                'steps': [{'label': date, 'method': 'animate', 'args': [[date], {'mode': 'immediate'}]}
+                          for date in dates],
+            }],
+            'updatemenus': [{
+                'type': 'buttons', 'showactive': False, 'x': 0, 'y': 0, 'xanchor': 'right', 'yanchor': 'top',
+                'pad': {'t': 30},
+                'buttons': [{'label': 'Play', 'method': 'animate', 'args': [None, {
+                    'fromcurrent': True, 'frame': {'duration': 120, 'redraw': True}, 'transition': {'duration': 0}}]}],
+            }],
+            'margin': {'l': 0, 'r': 0, 'b': 0},
+            'plot_bgcolor': colors['background'],
+            'paper_bgcolor': colors['background'],
+            'font': {'color': colors['text']},
+        },
+    }
+
+
+def matrix_figure(data):
+    # demographic_df2 holds one row (the latest values) per location, splom is WebGL
+    fig_matrix = px.scatter_matrix(data.demographic_df2, dimensions=["gdp_per_capita", "hospital_beds_per_thousand", "handwashing_facilities", "life_expectancy"],
+                                   labels={
+                                       "gdp_per_capita": 'GDPperCap',
+                                       "hospital_beds_per_thousand": 'BedsPer1000',
+                                       "handwashing_facilities": 'Handwashing',
+                                       "life_expectancy": "LifeExp"
+    },
+        color="continent", hover_name="location", symbol="continent",
+        title="What are some factors of GDP and Life Expectancy that might contribute to the Coronavirus?")
+    fig_matrix.update_traces(diagonal_visible=True)
+    fig_matrix.update_layout(
+        paper_bgcolor=colors['background'], font_color=colors['text'])
+    return fig_matrix
+
+
+def gapminder_figure(data):
+    df = px.data.gapminder().round({'gdpPercap': 2, 'lifeExp': 2})
+    fig_scatter = px.scatter(df, x="gdpPercap", y="lifeExp", animation_frame="year", animation_group="country",
+                             title="Overtime you will see that as GDP increases, life expectancy also increases.",
+                             size="pop", color="continent", hover_name="country", facet_col="continent",
+                             log_x=True, size_max=45, range_x=[100, 100000], range_y=[25, 90],
+                             render_mode=RENDER_MODE)
+    share_frames(fig_scatter)
+    fig_scatter.update_layout(
+        plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
+    return fig_scatter
+
+
+def scatter_figure(data):
+    fig_scatter2 = px.scatter(data.demographic_df3, x="gdp_per_capita", y="life_expectancy",
+                              title="Is there a relationship between GDP, Life Expectancy, and the Coronavirus?",
+                              size="total_deaths_per_million", color="continent",
+                              hover_name="location", log_x=True, size_max=60, render_mode=RENDER_MODE)
+    fig_scatter2.update_layout(
+        plot_bgcolor=colors['background'], paper_bgcolor=colors['background'], font_color=colors['text'])
+    return fig_scatter2
+
+
+@profiling.timed('status_figure')
+def status_window(wide, start=None, end=None, points=None):
+    """
+    Rows of wide (a column per case, indexed by date) from start to end (day
+    numbers), downsampled to about points dates with LTTB (see timerange.py).
+    The dates are picked from the total of the cases and kept for every case,
+    so the stacked areas and the grouped bars still line up.
+    """
+    day_numbers = wide.index.values.astype('datetime64[D]').astype(np.int64)
+    cut = timerange.window(day_numbers, start, end)
+    total = np.nansum(wide.to_numpy(dtype=np.float64)[cut], axis=1)
+    kept = timerange.lttb(day_numbers[cut], total[None], points or timerange.MAX_POINTS)[0]
+    return wide.iloc[cut].iloc[kept]
+
+
+def status_figure(data, x_axis, start=None, end=None, points=None):
+    # Cases by Status, cumulative area, day over day bars or the 7-day averages of the
+    # new cases, over a date window (day numbers) downsampled like the line graph. The
+    # semi-log variant and the axis title are applied in the browser (assets/clientside.js)
+    if x_axis == "Date":
+        totals = status_window(data.status_totals, start, end, points)
+        fig = px.area(
+            data_frame=timeseries.melt(totals.reset_index(), ['Date'], var_name='Case', value_name='Count'),
+            x=x_axis,
+            y="Count",
+            title='Count: by '+x_axis,
+            color='Case',
+            color_discrete_sequence=["green", "red", "#ffa500"],
+        )
+    elif x_axis == "Date2":
+        daily = status_window(data.status_totals.diff(), start, end, points)
+        fig = px.bar(timeseries.melt(daily.reset_index(), ['Date']), x="Date", y="value", color='variable',
+                     title='Count: by '+x_axis,
+                     color_discrete_sequence=["green", "red", "#ffa500"])
+        fig.update_layout(barmode='group')
+    else:
+        # precomputed rolling means of the JHU series (analytics.py)
+        averages = pd.DataFrame({name.capitalize(): pd.Series(data.analytics.world[name]['mean7'],
+                                                              index=data.series.dates[name])
+                                 for name in ('recovered', 'deaths', 'confirmed')})
+        averages.index = pd.to_datetime(averages.index, format='%m/%d/%y')
+        averages.index.name = 'Date'
+        averages = status_window(averages, start, end, points)
+        fig = px.line(timeseries.melt(averages.reset_index(), ['Date']), x="Date", y="value",
+                      color='variable', title='Count: by '+x_axis,
+                      color_discrete_sequence=["green", "red", colors['confirmed_text']])
+    fig.update_layout(
+        xaxis={'categoryorder': 'total ascending'},
+        title={'xanchor': 'center',
+               'yanchor': 'top', 'y': 0.9, 'x': 0.5, },
+        margin={'l': 0, 'r': 0, 'b': 0},
+        plot_bgcolor=colors['background'],
+        paper_bgcolor=colors['background'],
+        font_color=colors['text']
+    )
+    return fig
+
+
+def country_figure(detail):
+    # One country's cumulative series over its daily new cases and their 7-day average,
+    # built as a plain dict
+    # from a countries.CountryIndex lookup
+    palette = {'confirmed': colors['confirmed_text'], 'deaths': colors['deaths_text'],
+               'recovered': colors['recovered_text'], 'active': colors['active_text']}
+    traces = [{'type': 'scatter', 'mode': 'lines', 'name': name.capitalize(), 'x': detail['dates'],
+               'y': values, 'line': {'color': palette[name]}}
+              for name, values in detail['series'].items()]
+    traces.append({'type': 'bar', 'name': 'New confirmed', 'x': detail['dates'],
+                   'y': detail['daily']['confirmed'], 'marker': {'color': palette['confirmed']},
+                   'xaxis': 'x', 'yaxis': 'y2', 'showlegend': False})
+    traces.append({'type': 'scatter', 'mode': 'lines', 'name': '7-day average', 'x': detail['dates'],
+                   'y': detail['mean7']['confirmed'], 'line': {'color': colors['figure_text']},
+                   'xaxis': 'x', 'yaxis': 'y2', 'showlegend': False})
+    return {
+        'data': traces,
+        'layout': {
+            'title': {'text': detail['country'], 'x': 0.5, 'xanchor': 'center'},
+            'yaxis': {'domain': [0.32, 1], 'title': {'text': 'Total'}},
+            'yaxis2': {'domain': [0, 0.25], 'title': {'text': 'New'}},
+            'xaxis': {'anchor': 'y2', 'type': 'date'},
+            'margin': {'l': 0, 'r': 0, 'b': 0},
+            'hovermode': 'x',
+            'plot_bgcolor': colors['background'],
+            'paper_bgcolor': colors['background'],
+            'font': {'color': colors['text']},
+        },
+    }
+
+
+class FigureCache(object):
+    """
+    Serialized figures keyed by inputs and by the versions of their sources.
+
+    sources(key) names the sources a figure is derived from, an entry stays
+    valid until one of them changes in a newer generation. inputs(key) names
+    the Dataset attributes its builder reads. The JSON text and its parsed
+    form are kept, so a callback or layout returns plain lists and dicts and
+    never touches pandas or Plotly validation.
+    """
+
+    def __init__(self, builder, sources, inputs, keep=2):
+        self.builder = builder
+        self.sources = sources
+        self.inputs = inputs
+        self.keep = keep
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def stamp(self, data, *key):
+        """Versions of the sources of key in data, an entry is valid while they hold."""
+        return tuple(data.changed_at.get(source, data.version) for source in self.sources(key))
+
+    def _store(self, key, stamp, text):
+        entry = (text, json.loads(text))
+        with self.lock:
+            self.entries[(key, stamp)] = entry
+            # keep the newest few stamps of every key for requests still on older generations
+            stamps = [cached for cached in self.entries if cached[0] == key]
+            for cached in stamps[:-self.keep]:
+                del self.entries[cached]
+        return entry
+
+    def _entry(self, data, key):
+        stamp = self.stamp(data, *key)
+        entry = self.entries.get((key, stamp))
+        if entry is None:
+            entry = self._store(key, stamp, pio.to_json(self.builder(data, *key)))
+        return entry
+
+    def get(self, data, *key):
+        return self._entry(data, key)[1]
+
+    def json(self, data, *key):
+        return self._entry(data, key)[0]
+
+    def has(self, data, *key):
+        return (key, self.stamp(data, *key)) in self.entries
+
+    def cached(self, data, *key):
+        """JSON text of key for data when it is built, None otherwise."""
+        entry = self.entries.get((key, self.stamp(data, *key)))
+        return entry and entry[0]
+
+    def put(self, data, key, text):
+        """Keep the JSON text of key built elsewhere (by a build process) for data."""
+        self._store(key, self.stamp(data, *key), text)
+
+
+# figure name -> (builder, sources it is derived from, Dataset attributes it reads)
+FIGURES = {
+    'fig_map': (map_figure, ('confirmed',), ('covid_confirmed_agg',)),
+    'fig_tree': (tree_figure, ('full_table',), ('hierarchy',)),
+    'fig_line': (line_figure, ('confirmed',), ('covid_confirmed_agg', 'series')),
+    'fig_race': (race_figure, ('confirmed',), ('series',)),
+    'fig_matrix': (matrix_figure, ('demographic',), ('demographic_df2',)),
+    'fig_scatter': (gapminder_figure, (), ()),
+    'fig_scatter2': (scatter_figure, ('demographic',), ('demographic_df3',)),
+}
+
+# figures on tabs, only built and sent when their tab is first selected, and the bar chart
+# race, built with the first layout of a generation. A build pool builds them right away
+LAZY_FIGURES = ('fig_tree', 'fig_line', 'fig_race', 'fig_matrix',
+                'fig_scatter', 'fig_scatter2')
+
+
+def tab_figure(data, name):
+    return FIGURES[name][0](data)
+
+
+# xaxis_raditem values -> (sources, Dataset attributes read), the status figures built from
+# full_table or from the JHU series
+STATUS_AXES = OrderedDict([
+    ('Date', (('full_table',), ('status_totals',))),
+    ('Date2', (('full_table',), ('status_totals',))),
+    ('Date3', (('confirmed', 'deaths', 'recovered'), ('analytics', 'series'))),
+])
+
+# status_figures is keyed by the xaxis_raditem value, tab_figures by figure name
+status_figures = FigureCache(status_figure, lambda key: STATUS_AXES[key[0]][0],
+                             lambda key: STATUS_AXES[key[0]][1])
+tab_figures = FigureCache(tab_figure, lambda key: FIGURES[key[0]][1], lambda key: FIGURES[key[0]][2])
+
+CACHES = {'status': status_figures, 'tab': tab_figures}
+
+# every figure of a generation, (cache name, key)
+JOBS = [('status', (x_axis,)) for x_axis in STATUS_AXES] + [('tab', (name,)) for name in FIGURES]
+
+
+# ---------------------------------------------------------------------------------------------
+# Building in processes
+
+def build_job(cache, key, inputs):
+    """
+    JSON of the figure key of CACHES[cache], built from inputs (the Dataset
+    attributes it reads) in a build process, and the seconds it took.
+    """
+    start = time.perf_counter()
+    text = pio.to_json(CACHES[cache].builder(types.SimpleNamespace(**inputs), *key))
+    return text, time.perf_counter() - start
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _build_pool():
+    """The process pool building figures, None when building in-process."""
+    global _pool
+    if FIGURE_PROCESSES < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # from the fork server (see context.forkserver). The pool lives as long as the
+            # process, every generation is built by the same processes, no more than figures
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                min(FIGURE_PROCESSES, len(JOBS)), context.forkserver())
+    return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _figure_file(directory, cache, key):
+    return os.path.join(directory, '%s.%s.json' % (cache, key[0]))
+
+
+def load_figures(data, directory):
+    """Keep the figures of data another worker saved in directory."""
+    for cache, key in JOBS:
+        if not CACHES[cache].has(data, *key):
+            try:
+                with open(_figure_file(directory, cache, key)) as f:
+                    CACHES[cache].put(data, key, f.read())
+            except FileNotFoundError:
+                pass
+
+
+def save_figures(data, directory):
+    """Save the figures built for data in directory, for the other workers to load."""
+    for cache, key in JOBS:
+        text = CACHES[cache].cached(data, *key)
+        path = _figure_file(directory, cache, key)
+        if text is not None and not os.path.exists(path):
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+
+@profiling.phase('figures')
+def build_figures(data, directory=None):
+    """
+    Build the figures of a generation whose cached versions are out of date.
+
+    Figures whose sources did not change keep their entries from the previous
+    generation. The status figures and the map are always built, the tab
+    figures too when there is a build pool. directory, a shared generation's,
+    holds the figures another worker built for it: those are loaded instead of
+    built, and the ones built here are saved there.
+    """
+    if directory is not None:
+        load_figures(data, directory)
+    jobs = [(cache, key) for cache, key in JOBS if not CACHES[cache].has(data, *key)]
+
+    pool = _build_pool() if jobs else None
+    if pool is None:
+        # in-process, the lazy figures are left to their first request
+        for cache, key in jobs:
+            if key[0] not in LAZY_FIGURES:
+                CACHES[cache].get(data, *key)
+    else:
+        futures = [(cache, key, pool.submit(build_job, cache, key, {
+            attribute: getattr(data, attribute) for attribute in CACHES[cache].inputs(key)}))
+            for cache, key in jobs]
+        for cache, key, future in futures:
+            try:
+                text, seconds = future.result()
+            except Exception as error:
+                # built in-process on first use instead
+                profiling.log('figure_failed', 'error', cache=cache, figure=key[0])
+                if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                    # a build process died, the next generation starts a new pool
+                    _discard_pool(pool)
+                continue
+            CACHES[cache].put(data, key, text)
+            profiling.add_phase('figure', seconds, key[0])
+
+    if directory is not None:
+        save_figures(data, directory)
+    return data
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+gunicorn settings, read from the working directory (Procfile: gunicorn app:server --preload).
+
+The preloaded app only builds the Dash app, every worker starts loading the
+data right after it is forked instead of on its first request (see context.py).
+"""
+
+
+def post_fork(server, worker):
+    import context
+    context.start()
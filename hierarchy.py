@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+World -> country -> province rollup of full_table.
+
+The nodes (world, every country, every named province) and their parents are
+laid out once, with the values of every case column (Confirmed, Deaths,
+Recovered, Active) summed up the hierarchy for every date as a (node x date)
+array. A treemap or sunburst trace of any case at any date is then one column
+of that array, O(nodes), instead of px.treemap regrouping the frame.
+
+Rows without a province count towards their country only, negative counts
+(corrections in the active cases) as 0.
+"""
+
+import numpy as np
+import pandas as pd
+
+import timeseries
+
+ROOT = 'world'
+
+
+class Hierarchy(object):
+    """
+    ids, labels, parents  the nodes: the world, the countries, then the provinces
+    days                  sorted day numbers of the full_table dates
+    values[case]          (node x date) totals of a case column
+    """
+
+    def __init__(self, full_table, cases):
+        country_codes, countries = pd.factorize(full_table['Country/Region'], sort=True)
+        province_codes, provinces = pd.factorize(full_table['Province/State'], sort=True)
+        day_numbers = full_table['Date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        self.days, day_codes = np.unique(day_numbers, return_inverse=True)
+
+        # one leaf row per (country, province) pair
+        pairs, pair_codes = np.unique(country_codes * len(provinces) + province_codes, return_inverse=True)
+        pair_countries = pairs // len(provinces)
+        pair_provinces = np.asarray(provinces, dtype=object)[pairs % len(provinces)]
+        named = np.flatnonzero(pair_provinces != '')
+
+        country_ids = [ROOT + '/' + country for country in countries]
+        self.ids = [ROOT] + country_ids + [
+            country_ids[country] + '/' + province
+            for country, province in zip(pair_countries[named], pair_provinces[named])]
+        self.labels = [ROOT] + list(countries) + list(pair_provinces[named])
+        self.parents = [''] + [ROOT] * len(countries) + [country_ids[country] for country in pair_countries[named]]
+
+        self.values = {}
+        cells = pair_codes * len(self.days) + day_codes
+        for case in cases:
+            weights = np.maximum(full_table[case].to_numpy(dtype=np.float64), 0)
+            leaves = np.bincount(cells, weights=weights,
+                                 minlength=len(pairs) * len(self.days)).reshape(len(pairs), len(self.days))
+            by_country = timeseries.rollup(leaves, pair_countries, len(countries))
+            self.values[case] = np.vstack([by_country.sum(axis=0)[None], by_country,
+                                           leaves[named]]).astype(np.int64)
+
+    def position(self, day=None):
+        """Column of the latest date up to day (a day number), the last one by default."""
+        if day is None:
+            return len(self.days) - 1
+        return max(int(np.searchsorted(self.days, day, side='right')) - 1, 0)
+
+    def trace(self, case, position=-1, kind='treemap'):
+        """treemap or sunburst trace of a case column at a date, nodes without cases left out."""
+        values = self.values[case][:, position]
+        shown = np.flatnonzero(values > 0).tolist()
+        return {
+            'type': kind,
+            'ids': [self.ids[node] for node in shown],
+            'labels': [self.labels[node] for node in shown],
+            'parents': [self.parents[node] for node in shown],
+            'values': values[shown].tolist(),
+            'branchvalues': 'total',
+            'textinfo': 'label+value',
+        }
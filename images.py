@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Static images of the heaviest figures.
+
+fig_map, fig_tree and fig_line are rendered to PNG and SVG once per version of
+their sources, in a background pool, and kept on disk under IMAGE_DIR. The
+page shows the image first and loads the interactive figure when asked to (see
+app.py), link previews and slow clients never download the Plotly JSON.
+
+Rendering needs kaleido (in requirements.txt). Its scope needs plotly.js 1.55
+or newer, it is given the one bundled with the pinned plotly 4.10 or the file
+COVID19_IMAGE_PLOTLYJS names. Without it no images are made and the interactive figures are served as
+before. Every gunicorn worker renders in its own pool, a claim file makes sure
+each image is only rendered once.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import plotly
+
+import figures
+import profiling
+
+try:
+    from kaleido.scopes.plotly import PlotlyScope
+except ImportError:
+    PlotlyScope = None
+
+IMAGE_DIR = os.environ.get(
+    'COVID19_IMAGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images'))
+# plotly.js of the installed plotly (kaleido would fetch the latest from the CDN otherwise)
+IMAGE_PLOTLYJS = os.environ.get('COVID19_IMAGE_PLOTLYJS') or os.path.join(
+    os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+# directory of the map's topojson files, fetched from the plotly CDN otherwise
+IMAGE_TOPOJSON = os.environ.get('COVID19_IMAGE_TOPOJSON')
+IMAGE_WORKERS = int(os.environ.get('COVID19_IMAGE_WORKERS', 1))
+# '0' serves the interactive figures only
+STATIC_FIRST = os.environ.get('COVID19_STATIC_FIRST', '1') != '0'
+
+IMAGE_FIGURES = ('fig_map', 'fig_tree', 'fig_line')
+FORMATS = ('svg', 'png')
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+WIDTH = 1200
+HEIGHT = 700
+# versions of every image kept on disk
+KEEP = 2
+# seconds after which an unfinished render is given up
+CLAIM_TIMEOUT = 600
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def available():
+    return PlotlyScope is not None
+
+
+def path(data, name, image_format):
+    """File of the image of figure name in the generation data."""
+    stamp = '-'.join(str(version) for version in figures.tab_figures.stamp(data, name))
+    return os.path.join(IMAGE_DIR, '%s.%s.%s' % (name, stamp or '0', image_format))
+
+
+def ready(data, name, image_format='svg'):
+    """Path of the image when it has been rendered, None otherwise."""
+    image = path(data, name, image_format)
+    return image if available() and os.path.exists(image) else None
+
+
+def _scope():
+    # kaleido scopes talk to their own renderer process, one per pool thread
+    scope = getattr(_local, 'scope', None)
+    if scope is None:
+        scope = _local.scope = PlotlyScope(plotlyjs=IMAGE_PLOTLYJS, topojson=IMAGE_TOPOJSON, mathjax=False)
+    return scope
+
+
+def _figure(data, name):
+    return figures.tab_figures.get(data, name)
+
+
+def _prune(name):
+    # the newest KEEP versions of the images of a figure stay on disk, 'fig_map.3-1.svg'
+    # is version (3, 1)
+    entries = [entry for entry in os.listdir(IMAGE_DIR)
+               if entry.startswith(name + '.') and not entry.endswith('.tmp')]
+    stamps = sorted({entry.split('.')[1] for entry in entries},
+                    key=lambda stamp: [int(version) for version in stamp.split('-')])
+    for entry in entries:
+        if entry.split('.')[1] not in stamps[-KEEP:]:
+            try:
+                os.remove(os.path.join(IMAGE_DIR, entry))
+            except FileNotFoundError:
+                pass
+
+
+def render(data, name):
+    """Render the images of figure name in data that are not on disk yet."""
+    for image_format in FORMATS:
+        image = path(data, name, image_format)
+        try:
+            # whoever creates the claim renders, other workers and pools skip it
+            claim = os.open(image + '.tmp', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(image + '.tmp') > CLAIM_TIMEOUT:
+                    # left by a process that died while rendering, the next schedule retries
+                    os.remove(image + '.tmp')
+            except FileNotFoundError:
+                # the other renderer finished or gave up in between
+                pass
+            continue
+        try:
+            if os.path.exists(image):
+                continue
+            body = _scope().transform(_figure(data, name), format=image_format,
+                                      width=WIDTH, height=HEIGHT)
+            with os.fdopen(claim, 'wb') as out:
+                claim = None
+                out.write(body)
+            os.replace(image + '.tmp', image)
+        except Exception:
+            # the interactive figure is served instead, the next generation tries again
+            profiling.log('render_failed', 'error', figure=name, format=image_format)
+            return
+        finally:
+            if claim is not None:
+                os.close(claim)
+            if os.path.exists(image + '.tmp'):
+                os.remove(image + '.tmp')
+    _prune(name)
+
+
+def schedule(data):
+    """Render the images of the generation data in the background pool."""
+    global _pool
+    if not (STATIC_FIRST and available()):
+        return
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(IMAGE_WORKERS, thread_name_prefix='covid19-images')
+    for name in IMAGE_FIGURES:
+        if not all(os.path.exists(path(data, name, image_format)) for image_format in FORMATS):
+            _pool.submit(render, data, name)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Startup phases and callback latencies.
+
+phase() times a named step (download, parse, clean, aggregate, figures...) and
+the change in resident memory over it. Every finished phase is logged as one
+JSON line and kept in memory, log() does the same for events (a refresh, a
+failed download or render). timed() wraps a callback or view and records its
+latency in a histogram. All are reported by report(), which app.py serves on
+/debug/startup when enabled.
+
+Environment:
+    COVID19_PHASE_LOG   set to 0 to stop logging phases and info events to stdout,
+                        warnings and errors are logged regardless
+    COVID19_DEBUG       set to 1 to serve /debug/startup
+"""
+
+import bisect
+import collections
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+
+PHASE_LOG = os.environ.get('COVID19_PHASE_LOG', '1') != '0'
+DEBUG_ENDPOINT = os.environ.get('COVID19_DEBUG', '0') == '1'
+
+# latency bucket upper bounds in milliseconds, the last bucket is unbounded
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# phases kept for the report, the startup ones plus the latest refreshes
+MAX_PHASES = 500
+
+_started = time.time()
+_phases = collections.deque(maxlen=MAX_PHASES)
+_events = collections.deque(maxlen=MAX_PHASES)
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # peak rather than current, the best there is without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# ---------------------------------------------------------------------------------------------
+# phases
+
+@contextlib.contextmanager
+def phase(name, source=None):
+    """Time the enclosed block as phase name (of source, if given)."""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    record = collections.OrderedDict([('phase', name)])
+    if source is not None:
+        record['source'] = source
+    if stack:
+        record['parent'] = stack[-1]
+    stack.append(name)
+    memory = rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        record['rss_mb'] = round(rss() / 2 ** 20, 1)
+        record['rss_delta_mb'] = round(record['rss_mb'] - memory / 2 ** 20, 1)
+        _add(record, seconds)
+
+
+def add_phase(name, seconds, source=None, **info):
+    """Record a phase timed elsewhere, e.g. in a worker process."""
+    record = collections.OrderedDict([('phase', name)])
+    if source is not None:
+        record['source'] = source
+    record.update(info)
+    _add(record, seconds)
+
+
+def _add(record, seconds):
+    record['at'] = round(time.time() - _started, 3)
+    record['seconds'] = round(seconds, 4)
+    record['pid'] = os.getpid()
+    record['thread'] = threading.current_thread().name
+    with _lock:
+        _phases.append(record)
+    if PHASE_LOG:
+        print(json.dumps(record), flush=True)
+
+
+# ---------------------------------------------------------------------------------------------
+# events
+
+def log(event, level='info', **info):
+    """
+    Log an event (info, warning or error) as one JSON line. An error logged
+    while an exception is handled carries its traceback.
+    """
+    record = collections.OrderedDict([('event', event), ('level', level)])
+    record.update(info)
+    record['at'] = round(time.time() - _started, 3)
+    record['pid'] = os.getpid()
+    record['thread'] = threading.current_thread().name
+    if level == 'error' and sys.exc_info()[0] is not None:
+        record['traceback'] = traceback.format_exc()
+    with _lock:
+        _events.append(record)
+    if PHASE_LOG or level != 'info':
+        print(json.dumps(record, default=str), flush=True)
+
+
+# ---------------------------------------------------------------------------------------------
+# latencies
+
+class Histogram(object):
+    """Fixed-bucket latency histogram in milliseconds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 2)
+        return round(self.max, 2)
+
+    def as_dict(self):
+        return collections.OrderedDict([
+            ('count', self.count),
+            ('mean_ms', round(self.total / self.count, 2) if self.count else None),
+            ('p50_ms', self.quantile(0.5)),
+            ('p95_ms', self.quantile(0.95)),
+            ('max_ms', round(self.max, 2)),
+            ('buckets', collections.OrderedDict(
+                [('le_%g' % bound, count) for bound, count in zip(BUCKETS, self.counts)] +
+                [('inf', self.counts[-1])])),
+        ])
+
+
+def observe(name, ms):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(ms)
+
+
+def timed(name):
+    """Decorator recording the latency of every call under name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------------------------------------------
+# report
+
+def report():
+    """Phases, per phase totals, events and latency histograms of this process."""
+    with _lock:
+        phases = list(_phases)
+        events = list(_events)
+        histograms = {name: histogram.as_dict() for name, histogram in _histograms.items()}
+    totals = collections.OrderedDict()
+    for record in phases:
+        if record.get('parent') == record['phase']:
+            continue
+        total = totals.setdefault(record['phase'], {'seconds': 0.0, 'rss_delta_mb': 0.0})
+        total['seconds'] = round(total['seconds'] + record['seconds'], 4)
+        total['rss_delta_mb'] = round(total['rss_delta_mb'] + record.get('rss_delta_mb', 0.0), 1)
+    return collections.OrderedDict([
+        ('pid', os.getpid()),
+        ('uptime', round(time.time() - _started, 3)),
+        ('rss_mb', round(rss() / 2 ** 20, 1)),
+        ('totals', totals),
+        ('phases', phases),
+        ('events', events),
+        ('latency', histograms),
+    ])
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Background refresh of the dashboard data.
+
+The JHU wide-format files only grow to the right, so when one of them changed
+upstream only the header and the new date columns are parsed and appended to
+the current generation (dataset.extend). Anything else (new regions, revised
+history, the other sources) falls back to rebuilding the affected parts. The
+result is published atomically, workers never restart. With shared memory on,
+one worker refreshes and the others attach to what it shared (see arena.py).
+
+Environment:
+    COVID19_REFRESH_INTERVAL  seconds between refreshes (default 1 hour, 0 disables)
+"""
+
+import os
+import threading
+import time
+
+import pandas as pd
+
+import arena
+import datastore
+import dataset
+import figures
+import images
+import profiling
+
+REFRESH_INTERVAL = float(os.environ.get('COVID19_REFRESH_INTERVAL', 60 * 60))
+
+
+def new_date_columns(name, path, data):
+    """
+    The date columns of the file at path that data does not have yet, or None
+    when the file is not a pure extension of what we have (new regions,
+    reordered columns).
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    old = getattr(data, dataset.JHU_FRAMES[name])
+    known = len(old.columns)
+    if list(header[:4]) != dataset.ID_COLUMNS or list(header[4:known]) != list(old.columns[4:]):
+        return None
+
+    columns = list(header[:4]) + list(header[known:])
+    new = pd.read_csv(path, usecols=columns)[columns]
+    ids = dataset.clean_jhu(new.iloc[:, :4].copy())
+    if len(ids) != len(old) or not ids.iloc[:, :2].equals(old.iloc[:, :2]):
+        return None
+    return new.iloc[:, 4:]
+
+
+def refresh_once():
+    """Fetch every source, publish a new generation if anything changed."""
+    data = dataset.current()
+    digests = {}
+    new_dates = {}
+    full = {}
+
+    # conditional requests only against snapshots holding what this generation has
+    manifests = {}
+    for name in datastore.SOURCES:
+        manifest = datastore.read_manifest(name)
+        if manifest and manifest['sha1'] == data.digests.get(name):
+            manifests[name] = manifest
+
+    for name, fetched, error in datastore.download_all(list(datastore.SOURCES), manifests):
+        if error is not None:
+            # keep serving what we have for this source, the others still refresh
+            profiling.log('fetch_failed', 'warning', source=name, error=repr(error), fallback='current data')
+            continue
+        if fetched is None:
+            continue
+        try:
+            if fetched.sha1 == data.digests.get(name):
+                continue
+
+            try:
+                dates = None
+                if name in dataset.JHU_SOURCES:
+                    dates = new_date_columns(name, fetched.path, data)
+                if dates is None or not dates.shape[1]:
+                    # revised history or another source, parse it whole
+                    with profiling.phase('parse', name):
+                        frame = datastore.parse(name, fetched.path)
+            except Exception as error:
+                # a broken upstream file, keep serving what we have for this source
+                profiling.log('parse_failed', 'warning', source=name, error=repr(error), fallback='current data')
+                continue
+
+            digests[name] = fetched.sha1
+            if dates is not None and dates.shape[1]:
+                datastore.append_snapshot(name, dates, fetched.sha1, fetched.validators)
+                new_dates[name] = dates
+            else:
+                full[name] = frame
+                datastore.save_snapshot(name, frame, fetched.sha1, fetched.validators)
+        finally:
+            datastore.discard(fetched)
+
+    if not digests:
+        return data
+
+    if set(full) & set(dataset.JHU_SOURCES):
+        # the wide files were restructured, rebuild everything
+        frames = {name: full[name] if name in full else datastore.load_snapshot(name)
+                  for name in datastore.SOURCES}
+        data = dataset.build(frames, dict(data.digests, **digests), data.version + 1)
+    else:
+        data = dataset.extend(data, new_dates)
+        if 'full_table' in full:
+            dataset.clean_full_table(data, full['full_table'])
+        if 'demographic' in full:
+            dataset.clean_demographic(data, full['demographic'])
+        data.digests.update(digests)
+        data.changed_at.update(dict.fromkeys(digests, data.version))
+
+    # built while the arena is locked, the other workers load the figures saved with it
+    arena.share(data)
+    figures.build_figures(data, arena.figure_directory())
+    return dataset.publish(data)
+
+
+def refresh():
+    """
+    refresh_once coordinated across workers: whoever holds the arena lock first
+    checks upstream, the others attach to the generation it shared.
+    """
+    if not arena.SHARED_MEMORY:
+        return refresh_once()
+    data = dataset.current()
+    with arena.locked():
+        manifest = arena.latest()
+        if manifest and manifest['version'] > data.version:
+            shared = arena.attach(manifest, data)
+            figures.build_figures(shared, arena.figure_directory(manifest))
+            return dataset.publish(shared)
+        if manifest and time.time() - manifest['checked_at'] < REFRESH_INTERVAL / 2:
+            # another worker just checked upstream
+            return data
+        refreshed = refresh_once()
+        if refreshed is data:
+            arena.touch()
+        return refreshed
+
+
+@profiling.phase('startup')
+def load():
+    """Build, share and publish the first generation."""
+    if arena.SHARED_MEMORY:
+        with arena.locked():
+            # workers load after the fork, the first one shares what it built (the figures
+            # too) and the others attach to it while the snapshots have not changed since
+            manifest = arena.latest()
+            snapshots = {name: (datastore.read_manifest(name) or {}).get('sha1') for name in datastore.SOURCES}
+            if manifest and manifest['digests'] == snapshots:
+                return dataset.publish(figures.build_figures(
+                    arena.attach(manifest), arena.figure_directory(manifest)))
+            data = arena.share(dataset.load())
+            return dataset.publish(figures.build_figures(data, arena.figure_directory()))
+    return dataset.publish(figures.build_figures(dataset.load()))
+
+
+class Refresher(threading.Thread):
+    """Daemon thread running refresh every interval seconds."""
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        super(Refresher, self).__init__(name='covid19-refresh', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                data = refresh()
+                profiling.log('refresh_done', generation=data.version)
+                images.schedule(data)
+            except Exception:
+                # keep serving the current generation and try again next interval
+                profiling.log('refresh_failed', 'error')
+
+    def stop(self):
+        self.stopped.set()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start():
+    """Start the refresh thread once per process (call after the gunicorn fork)."""
+    global _refresher
+    # the static images render in a background pool, threads are started after the fork too
+    images.schedule(dataset.current())
+    with _refresher_lock:
+        if _refresher is None and REFRESH_INTERVAL > 0:
+            _refresher = Refresher()
+            _refresher.start()
+    return _refresher
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Pre-serialized, pre-compressed responses.
+
+The layout of a data generation and the tab figures are encoded to JSON once,
+compressed once (gzip, and brotli when brotlipy is installed) and then served
+as stored bytes with a strong ETag, so repeat requests never go through the
+Plotly JSON encoder again. Conditional GETs get a 304.
+
+Dash is a dash.Dash that serves the layout this way and answers the callbacks
+registered with payload_callback from stored bytes.
+
+orjson is used for encoding when it is installed, the standard library
+otherwise.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import dash
+import flask
+import plotly
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# compression levels, a payload is only compressed once per data generation
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+
+# everything served changes with the data generation, caches must revalidate (and get a 304)
+CACHE_CONTROL = 'public, no-cache'
+
+
+def _default(obj):
+    # Dash components and Plotly figures, numpy and pandas values
+    if hasattr(obj, 'to_plotly_json'):
+        return obj.to_plotly_json()
+    return plotly.utils.PlotlyJSONEncoder().default(obj)
+
+
+def encode(obj):
+    """Compact JSON bytes of obj."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+class Payload(object):
+    """A JSON response body with its compressed variants and a strong ETag."""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:24]
+        self.encoded = OrderedDict()
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.encoded['gzip'] = gzip.compress(body, GZIP_LEVEL)
+
+    def response(self, cache_control=None):
+        """flask.Response for the current request, 304 when the client has it."""
+        accepted = flask.request.accept_encodings
+        encoding = next((encoding for encoding in self.encoded if encoding in accepted), None)
+        # a strong ETag names one exact representation
+        etag = self.etag + ('-' + encoding if encoding else '')
+
+        if flask.request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            response = flask.Response(self.encoded[encoding] if encoding else self.body,
+                                      mimetype='application/json')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+        return response
+
+
+class Payloads(object):
+    """Payloads keyed by name, the newest few stamps (data versions) of each."""
+
+    def __init__(self, keep=2):
+        self.keep = keep
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, name, stamp, build):
+        """Payload of name at stamp, build() returns its body when missing."""
+        payload = self.entries.get((name, stamp))
+        if payload is not None:
+            return payload
+        payload = Payload(build())
+        with self.lock:
+            self.entries[(name, stamp)] = payload
+            stamps = [cached for cached in self.entries if cached[0] == name]
+            for cached in stamps[:-self.keep]:
+                del self.entries[cached]
+        return payload
+
+
+def callback_body(component_id, prop, value_json):
+    """Body of a Dash callback response setting one property to serialized JSON."""
+    return b''.join([b'{"response":{', encode(component_id), b':{', encode(prop), b':',
+                     value_json, b'}},"multi":true}'])
+
+
+class Dash(dash.Dash):
+    """
+    dash.Dash serving stored payloads.
+
+    layout_stamp() names the data version the layout was built from, the
+    serialized layout is reused until it changes. payload_callback registers
+    a function answering a callback output with a Payload (or None to run the
+    regular callback).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.layout_stamp = kwargs.pop('layout_stamp', None)
+        self.payloads = Payloads()
+        self.payload_callbacks = {}
+        super(Dash, self).__init__(*args, **kwargs)
+
+    def serve_layout(self):
+        if self.layout_stamp is None:
+            return super(Dash, self).serve_layout()
+        payload = self.payloads.get('layout', self.layout_stamp(),
+                                    lambda: encode(self._layout_value()))
+        return payload.response(CACHE_CONTROL)
+
+    def payload_callback(self, output, function):
+        """function(*input values) -> Payload or None, for output 'id.property'."""
+        self.payload_callbacks[output] = function
+
+    def dispatch(self):
+        body = flask.request.get_json()
+        function = self.payload_callbacks.get(body['output'])
+        if function is not None:
+            payload = function(*[item.get('value') for item in body.get('inputs', [])])
+            if payload is not None:
+                return payload.response()
+        return super(Dash, self).dispatch()
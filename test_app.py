@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+The server answers before the data is loaded (python -m unittest test_app).
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('COVID19_DEBUG', '1')
+
+import app
+import context
+
+# every route reading the data generation
+DATA_ROUTES = (
+    '/debug/validation',
+    '/api/country/China',
+    '/api/range?metric=confirmed',
+    '/api/v1/world',
+    '/api/v1/countries',
+    '/api/v1/timeseries?country=China',
+    '/images/fig_map.svg',
+)
+
+
+class BeforeLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        # the data never starts loading
+        patcher = mock.patch.object(context, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertFalse(context.ready())
+        self.client = app.server.test_client()
+
+    def test_health(self):
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_data_routes(self):
+        for route in DATA_ROUTES:
+            with self.subTest(route=route):
+                response = self.client.get(route)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], str(app.RETRY_AFTER))
+                self.assertFalse(response.get_json()['ready'])
+
+    def test_placeholder_layout(self):
+        response = self.client.get('/_dash-layout')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'placeholder_interval', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
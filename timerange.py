@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Date windows of the dense series, downsampled for plotting.
+
+A window is cut with a binary search (np.searchsorted) over the sorted day
+numbers of the series dates, then every line is reduced with
+Largest-Triangle-Three-Buckets to about as many points as a plot has pixels,
+so a payload stays bounded whether it covers the last weeks or every date.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# points per line sent to the browser, about the width of a plot in pixels
+MAX_POINTS = int(os.environ.get('COVID19_MAX_POINTS', 500))
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def days(dates):
+    """Day numbers (days since 1970-01-01) of JHU date labels ('m/d/yy')."""
+    return pd.to_datetime(dates, format='%m/%d/%y').values.astype('datetime64[D]').astype(np.int64)
+
+
+def day(value):
+    """Day number of an ISO date ('2020-03-01')."""
+    return int((np.datetime64(value, 'D') - EPOCH).astype(np.int64))
+
+
+def iso(day_numbers):
+    """ISO date labels of day numbers."""
+    return np.datetime_as_string(EPOCH + np.asarray(day_numbers, dtype='timedelta64[D]')).tolist()
+
+
+def window(day_numbers, start=None, end=None):
+    """Slice of the sorted day_numbers from start to end (day numbers, both included)."""
+    lo = 0 if start is None else np.searchsorted(day_numbers, start, side='left')
+    hi = len(day_numbers) if end is None else np.searchsorted(day_numbers, end, side='right')
+    return slice(lo, max(lo, hi))
+
+
+def lttb(x, y, threshold):
+    """
+    Positions of the points Largest-Triangle-Three-Buckets keeps in every row of y.
+
+    y is a (rows x len(x)) array, the result a (rows x threshold) array of
+    positions, the first and the last point included. The buckets are the same
+    for every row, so each step runs over all the rows at once.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    rows, n = y.shape
+    if threshold >= n or threshold < 3:
+        return np.tile(np.arange(n), (rows, 1))
+    x = np.asarray(x, dtype=np.float64)
+
+    # threshold - 2 buckets between the first and the last point
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    edges = np.append(edges, n)
+    kept = np.empty((rows, threshold), dtype=np.int64)
+    kept[:, 0] = 0
+    kept[:, -1] = n - 1
+    every = np.arange(rows)
+    previous = np.zeros(rows, dtype=np.int64)
+    for bucket in range(threshold - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # the third vertex is the mean of the next bucket (the last point after the last bucket)
+        next_lo, next_hi = hi, edges[bucket + 2]
+        mean_x = x[next_lo:next_hi].mean()
+        mean_y = y[:, next_lo:next_hi].mean(axis=1)
+        ax = x[previous][:, None]
+        ay = y[every, previous][:, None]
+        area = np.abs((ax - mean_x) * (y[:, lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[:, None] - ay))
+        previous = lo + area.argmax(axis=1)
+        kept[:, bucket + 1] = previous
+    return kept
+
+
+def downsample(day_numbers, values, start=None, end=None, points=MAX_POINTS):
+    """
+    Window of (rows x dates) values downsampled to points per row.
+
+    Returns the ISO dates and the values of every row, lists of lists.
+    """
+    cut = window(day_numbers, start, end)
+    day_numbers = day_numbers[cut]
+    values = values[:, cut]
+    kept = lttb(day_numbers, values, points)
+    rows = np.arange(len(values))[:, None]
+    return ([iso(day_numbers[positions]) for positions in kept],
+            values[rows, kept].tolist())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Dense time-series core for the JHU wide-format files.
+
+Every metric (confirmed, deaths, recovered) is held as a (region x date) NumPy
+array whose rows map into one shared country index. The values are validated
+and corrected first (validation.py). The country and world
+rollups are computed once with vectorized reductions when the series is built,
+and appending new dates only reduces the new columns. The frames the dashboard
+uses are built straight from these arrays instead of regrouping and melting
+the wide frames.
+"""
+
+import copy
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import profiling
+import timerange
+import validation
+
+
+def rollup(values, codes, size):
+    """Sum the rows of values that share a code, one output row per code."""
+    order = np.argsort(codes, kind='stable')
+    ordered = codes[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    out = np.zeros((size,) + values.shape[1:], dtype=values.dtype)
+    if len(ordered):
+        out[ordered[starts]] = np.add.reduceat(values[order], starts, axis=0)
+    return out
+
+
+def top(values, n):
+    """
+    Rows of the n largest values of every column of a (row x date) array,
+    largest first, as an (n x date) array. Every date is ranked at once, a
+    partition picks the n rows and only those are sorted.
+    """
+    n = min(n, len(values))
+    if n == 0:
+        return np.empty((0, values.shape[1]), dtype=np.int64)
+    if n < len(values):
+        rows = np.argpartition(-values, n - 1, axis=0)[:n]
+    else:
+        rows = np.tile(np.arange(n)[:, None], (1, values.shape[1]))
+    order = np.argsort(-np.take_along_axis(values, rows, axis=0), axis=0, kind='stable')
+    return np.take_along_axis(rows, order, axis=0)
+
+
+def melt(frame, id_vars, var_name='variable', value_name='value'):
+    """pd.melt of every non-id column of frame, built with numpy tile/repeat."""
+    values = frame.drop(columns=id_vars)
+    rows, columns = values.shape
+    long = {column: np.tile(frame[column].to_numpy(), columns) for column in id_vars}
+    long[var_name] = np.repeat(values.columns.to_numpy(dtype=object), rows)
+    long[value_name] = values.to_numpy().T.ravel()
+    return pd.DataFrame(long, columns=list(id_vars) + [var_name, value_name])
+
+
+class TimeSeries(object):
+    """
+    The JHU metrics as dense arrays.
+
+    values[name]   (region x date) array of the metric
+    codes[name]    country index position of every region row
+    dates[name]    date column labels
+    days[name]     sorted day numbers of the dates, to cut date windows with
+    country[name]  (country x date) rollup
+    world[name]    per date world total
+    audit[name]    what validation.correct found and corrected in the values
+
+    revised names the metrics whose earlier dates an append corrected.
+    """
+
+    def __init__(self, frames):
+        # frames: metric name -> cleaned wide frame (Province/State, country, Lat, Long, dates...)
+        self.countries = pd.Index(np.unique(np.concatenate(
+            [frame['country'].to_numpy(dtype=object) for frame in frames.values()])))
+        self.values = {}
+        self.codes = {}
+        self.dates = {}
+        self.days = {}
+        self.country = {}
+        self.world = {}
+        self.audit = {}
+        self.revised = ()
+        for name, frame in frames.items():
+            with profiling.phase('validate', name):
+                self.values[name], self.audit[name] = validation.correct(frame.iloc[:, 4:].to_numpy())
+            self.codes[name] = self.countries.get_indexer(frame['country'])
+            self.dates[name] = frame.columns[4:]
+            self.days[name] = timerange.days(self.dates[name])
+            self.country[name] = rollup(self.values[name], self.codes[name], len(self.countries))
+            self.world[name] = self.values[name].sum(axis=0)
+
+        # country positions, the mean of their regions in the confirmed file
+        codes = self.codes['confirmed']
+        self.regions = np.bincount(codes, minlength=len(self.countries))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.positions = rollup(frames['confirmed'][['Lat', 'Long']].to_numpy(
+                dtype=np.float64), codes, len(self.countries)) / self.regions[:, None]
+
+    def append(self, new_dates):
+        """
+        Series extended by new date columns.
+
+        new_dates maps a metric to a frame of its new date columns, rows in the
+        order of the original frame. Only the new columns are reduced.
+        """
+        series = copy.copy(self)
+        for attribute in ('values', 'dates', 'days', 'country', 'world', 'audit'):
+            setattr(series, attribute, dict(getattr(self, attribute)))
+        revised = []
+        for name, dates in new_dates.items():
+            known = self.values[name].shape[1]
+            with profiling.phase('validate', name):
+                series.values[name], audit, rows = validation.extend(self.values[name], dates.to_numpy())
+            series.audit[name] = validation.merge(self.audit[name], audit)
+            series.dates[name] = self.dates[name].append(dates.columns)
+            series.days[name] = np.concatenate([self.days[name], timerange.days(dates.columns)])
+            if len(rows):
+                # corrections reached earlier dates, the rollups are computed again
+                revised.append(name)
+                series.country[name] = rollup(series.values[name], self.codes[name], len(self.countries))
+                series.world[name] = series.values[name].sum(axis=0)
+                continue
+            values = series.values[name][:, known:]
+            series.country[name] = np.hstack([self.country[name], rollup(
+                values, self.codes[name], len(self.countries))])
+            series.world[name] = np.concatenate([self.world[name], values.sum(axis=0)])
+        series.revised = tuple(revised)
+        return series
+
+    def audit_report(self):
+        """The audits with country names and dates, as plain JSON values."""
+        report = OrderedDict()
+        for name, audit in self.audit.items():
+            report[name] = OrderedDict((key, audit[key]) for key in validation.COUNTS)
+            for key in validation.REGIONS:
+                report[name][key] = len(audit[key])
+            report[name]['stale_regions'] = audit['stale_regions']
+            for key in ('largest_drops', 'largest_outliers'):
+                report[name][key] = [OrderedDict([
+                    ('country', self.countries[self.codes[name][row]]),
+                    ('date', self.dates[name][column]),
+                    ('amount', amount),
+                ]) for row, column, amount in audit[key]]
+        return report
+
+    def world_series(self, name):
+        return pd.Series(self.world[name], index=self.dates[name])
+
+    def country_frame(self, name):
+        """Wide per-country frame (country, Lat, Long, dates...) of a metric."""
+        present = np.flatnonzero(self.regions)
+        frame = pd.DataFrame(self.country[name][present], columns=self.dates[name])
+        frame.insert(0, 'Long', self.positions[present, 1])
+        frame.insert(0, 'Lat', self.positions[present, 0])
+        frame.insert(0, 'country', self.countries[present].to_numpy(dtype=object))
+        return frame
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+__author__ = "Nathaniel Habtegergesa"
+
+"""
+Validation and correction of the cumulative JHU series.
+
+Every check runs over the whole (region x date) array at once:
+
+    gaps        a region reporting 0 after it had cases stopped reporting (JHU
+                zeroed the recovered file), the last reported value is carried
+                forward
+    drops       a cumulative count lower than the day before (a correction of
+                earlier overcounts). 'backward' lowers the earlier days to the
+                corrected count, 'forward' holds the highest count until the
+                series catches up
+    outliers    a daily increase over OUTLIER_FACTOR times the average of the
+                week before (backlogs reported in one day), only reported
+    stale       regions whose count has not moved for STALE_DAYS, only reported
+
+The audit counts what was found and keeps the largest findings.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# 'backward', 'forward' or 'off'
+MONOTONIC = os.environ.get('COVID19_MONOTONIC', 'backward')
+FILL_GAPS = os.environ.get('COVID19_FILL_GAPS', '1') != '0'
+# 0 turns the outlier check off
+OUTLIER_FACTOR = float(os.environ.get('COVID19_OUTLIER_FACTOR', 10))
+OUTLIER_MIN = 100
+WINDOW = 7
+STALE_DAYS = 14
+
+# columns before appended dates the checks look back on
+CONTEXT = STALE_DAYS + 1
+# largest findings kept in the audit
+LARGEST = 5
+
+COUNTS = ('gaps', 'drops', 'outliers')
+# rows of the regions with gaps or drops
+REGIONS = ('gap_regions', 'drop_regions')
+
+
+def _largest(mask, amounts, offset):
+    # (row, column, amount) of the largest amounts where mask holds
+    rows, columns = np.nonzero(mask)
+    amounts = amounts[rows, columns]
+    order = np.argsort(-np.abs(amounts), kind='stable')[:LARGEST]
+    return [(int(rows[i]), int(columns[i]) + offset, amounts[i].item()) for i in order]
+
+
+def correct(values, start=0):
+    """
+    Corrected copy of a (region x date) cumulative array, and its audit.
+
+    Findings are only counted from column start on, the columns before it are
+    the already validated context of appended dates.
+    """
+    audit = OrderedDict((name, 0) for name in COUNTS)
+    audit.update((name, np.array([], dtype=np.int64)) for name in REGIONS)
+    audit['stale_regions'] = 0
+    rows, columns = values.shape
+    counted = np.arange(columns) >= start
+
+    if FILL_GAPS:
+        reported = values > 0
+        gaps = np.maximum.accumulate(reported, axis=1) & ~reported & counted
+        audit['gaps'] = int(gaps.sum())
+        audit['gap_regions'] = np.flatnonzero(gaps.any(axis=1))
+        if audit['gaps']:
+            # position of the last reported value at every date
+            last = np.where(reported, np.arange(columns), 0)
+            np.maximum.accumulate(last, axis=1, out=last)
+            values = np.take_along_axis(values, last, axis=1)
+
+    change = np.diff(values, axis=1)
+    drops = (change < 0) & counted[1:]
+    audit['drops'] = int(drops.sum())
+    audit['drop_regions'] = np.flatnonzero(drops.any(axis=1))
+    audit['largest_drops'] = _largest(drops, change, 1)
+    if audit['drops'] and MONOTONIC == 'backward':
+        values = np.minimum.accumulate(values[:, ::-1], axis=1)[:, ::-1]
+    elif audit['drops'] and MONOTONIC == 'forward':
+        values = np.maximum.accumulate(values, axis=1)
+
+    audit['largest_outliers'] = []
+    if OUTLIER_FACTOR and columns > WINDOW + 1:
+        daily = np.diff(values, axis=1).astype(np.float64)
+        # average daily increase of the week before every date
+        before = (values[:, WINDOW:-1] - values[:, :-WINDOW - 1]) / WINDOW
+        spikes = daily[:, WINDOW:]
+        outliers = ((spikes > OUTLIER_FACTOR * np.maximum(before, 1)) & (spikes > OUTLIER_MIN)
+                    & counted[WINDOW + 1:])
+        audit['outliers'] = int(outliers.sum())
+        audit['largest_outliers'] = _largest(outliers, spikes, WINDOW + 1)
+
+    if columns > STALE_DAYS:
+        tail = values[:, -STALE_DAYS - 1:]
+        audit['stale_regions'] = int(((tail == tail[:, -1:]).all(axis=1) & (tail[:, -1] > 0)).sum())
+    return values, audit
+
+
+def extend(history, new):
+    """
+    Validated history (region x date) with the new date columns appended.
+
+    Only the new columns and the CONTEXT columns before them are checked. Rows
+    whose drops reach back into the history ('backward') are corrected again
+    in full. Returns the values, the audit of the new columns and the rows
+    whose history changed.
+    """
+    context = min(history.shape[1], CONTEXT)
+    block, audit = correct(np.hstack([history[:, history.shape[1] - context:], new]), context)
+    offset = history.shape[1] - context
+    for name in ('largest_drops', 'largest_outliers'):
+        audit[name] = [(row, column + offset, amount) for row, column, amount in audit[name]]
+
+    values = np.hstack([history, block[:, context:]])
+    revised = np.flatnonzero((block[:, :context] != history[:, offset:]).any(axis=1))
+    if len(revised):
+        values[revised] = correct(values[revised])[0]
+    return values, audit, revised
+
+
+def merge(audit, new):
+    """Audit of a series extended with the audit of its new columns."""
+    merged = OrderedDict((name, audit[name] + new[name]) for name in COUNTS)
+    merged.update((name, np.union1d(audit[name], new[name])) for name in REGIONS)
+    # stale regions are a state of the latest dates
+    merged['stale_regions'] = new['stale_regions']
+    for name in ('largest_drops', 'largest_outliers'):
+        merged[name] = sorted(audit[name] + new[name], key=lambda finding: -abs(finding[2]))[:LARGEST]
+    return merged